@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: table-driven CRC16 vs the original bit-by-bit loop.
+Run from the repo root: python3 bench/bench_crc.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from modbus import CRC16, Modbus  # noqa: E402
+
+
+def crc_bitwise(data: bytes) -> int:
+    """The original implementation, kept here as the reference"""
+    crc = 0xFFFF
+    for i in data:
+        crc ^= i
+        for _ in range(8):
+            if crc & 1:
+                crc >>= 1
+                crc ^= 0xa001
+            else:
+                crc >>= 1
+    return crc
+
+
+FRAMES = {
+    "tx read (6 bytes)": bytes.fromhex("010300100001"),
+    "rx word (5 bytes)": bytes.fromhex("0103020190"),
+    "rx block (11 bytes)": bytes.fromhex("01030801900064000003e8"),
+}
+
+
+def main():
+    number = 20000
+    for name, frame in FRAMES.items():
+        assert crc_bitwise(frame) == Modbus.calculate_crc(frame) == CRC16(frame).value
+        inc = CRC16()
+        for b in frame:
+            inc.update(bytes((b,)))
+        assert inc.value == crc_bitwise(frame)
+
+        t_old = timeit.timeit(lambda: crc_bitwise(frame), number=number)
+        t_new = timeit.timeit(lambda: Modbus.calculate_crc(frame), number=number)
+        print(
+            f"{name:20s} bitwise {t_old / number * 1e6:6.2f} us  "
+            f"table {t_new / number * 1e6:6.2f} us  "
+            f"x{t_old / t_new:4.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
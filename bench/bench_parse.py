@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: CommandFactory.parse on the cache hit and miss paths,
+against the old resolver that tried every command's regex in turn.
+Run from the repo root: python3 bench/bench_parse.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from hm305.command_factory import CommandFactory  # noqa: E402
+
+
+def regex_scan(cmd_name):
+    """The original cache-miss path, kept here as the reference"""
+    for cmd_expr, cmd_info in CommandFactory.Commands.command_expressions.items():
+        if cmd_info["re"].match(cmd_name):
+            return cmd_expr
+    raise KeyError(cmd_name)
+
+
+def main():
+    number = 20000
+    commands = CommandFactory.Commands
+
+    hit = timeit.timeit(lambda: CommandFactory.parse("CURR:SETP?"), number=number)
+
+    names = [f"CURRENT:SETPOINT{i}" for i in range(number)]  # never resolve, never cached
+    it = iter(names)
+    miss = timeit.timeit(lambda: CommandFactory.parse(f"{next(it)}?"), number=number)
+
+    def clear_and_resolve():
+        commands._command_cache.clear()
+        commands.get_command_expression("current:setpoint")
+
+    trie = timeit.timeit(clear_and_resolve, number=number)
+    scan = timeit.timeit(lambda: regex_scan("current:setpoint"), number=number)
+
+    trie_miss = timeit.timeit(lambda: commands._trie.find("SYSTEM:ERROR"), number=number)
+
+    def scan_miss():
+        try:
+            regex_scan("SYSTEM:ERROR")
+        except KeyError:
+            pass
+
+    scan_miss_t = timeit.timeit(scan_miss, number=number)
+
+    print(f"parse, cache hit          {hit / number * 1e6:6.2f} us")
+    print(f"parse, unknown command    {miss / number * 1e6:6.2f} us")
+    print(f"resolve uncached: trie    {trie / number * 1e6:6.2f} us")
+    print(f"resolve uncached: regexes {scan / number * 1e6:6.2f} us")
+    print(f"resolve unknown: trie     {trie_miss / number * 1e6:6.2f} us")
+    print(f"resolve unknown: regexes  {scan_miss_t / number * 1e6:6.2f} us")
+    print(f"cache entries after run   {len(commands._command_cache)} (cap {commands.cache_size})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark.
+1. Import time of each package in a fresh interpreter, checked against a budget
+   (exits non-zero if any module is over, so it can gate CI).
+2. That hm305.py's own imports don't pull in the server side (also gating).
+3. Wall time of `hm305.py --get` against a simulated supply on a pty.
+
+Run from the repo root: python3 bench/bench_startup.py [--budget-ms 150] [--runs 10]
+"""
+import argparse
+import os
+import pty
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from modbus import Modbus  # noqa: E402
+
+CLI_IMPORTS = "hm305, hm305.client, hm305.datalog, hm305.shm"  # what hm305.py imports, keep in step
+MODULES = ["scpi", "modbus", "hm305", "hm305.server", CLI_IMPORTS]
+SERVER_ONLY = ["scpi", "hm305.server_commands", "hm305.scheduler"]  # hm305.py has no use for these
+
+
+def import_time(module: str, runs: int) -> float:
+    """Best of runs, in seconds"""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - t)"
+    )
+    best = None
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+        )
+        t = float(out.stdout)
+        best = t if best is None else min(best, t)
+    return best
+
+
+def cli_leaks() -> list:
+    """The SERVER_ONLY modules that importing hm305.py's dependencies loads"""
+    code = f"import sys; import {CLI_IMPORTS}; print(' '.join(m for m in {SERVER_ONLY!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return out.stdout.split()
+
+
+def respond(master: int, regs: dict):
+    """Answer 0x03 reads from regs and echo 0x06 writes, until the pty closes"""
+    while True:
+        try:
+            req = os.read(master, 8)
+        except OSError:
+            return
+        if len(req) < 8:
+            continue
+        dev, fn, addr, val = struct.unpack(">BBHH", req[:6])
+        if fn == Modbus.ReadMultichannelRegisterInput:
+            words = [regs.get(addr + i, 0) for i in range(val)]
+            resp = struct.pack(f">BBB{val}H", dev, fn, val * 2, *words)
+        else:
+            regs[addr] = val
+            resp = req[:6]
+        os.write(master, resp + struct.pack("<H", Modbus.calculate_crc(resp)))
+
+
+def cli_time(runs: int) -> float:
+    """Mean wall time of `hm305.py --get`, in seconds"""
+    master, slave = pty.openpty()
+    port = os.ttyname(slave)
+    regs = {0x0010: 500, 0x0011: 250, 0x0012: 0, 0x0013: 1250}
+    threading.Thread(target=respond, args=(master, regs), daemon=True).start()
+    total = 0.0
+    for _ in range(runs):
+        t = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, "hm305.py"), "--port", port, "--get"],
+            cwd=ROOT,
+            capture_output=True,
+            check=True,
+        )
+        total += time.perf_counter() - t
+    os.close(slave)
+    return total / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="import time budget per module")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--skip-cli", action="store_true", help="only check import times")
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in MODULES:
+        t = import_time(module, args.runs) * 1e3
+        verdict = "ok" if t <= args.budget_ms else "OVER BUDGET"
+        over_budget |= t > args.budget_ms
+        print(f"import {module:15s} {t:7.1f} ms  {verdict}")
+    leaks = cli_leaks()
+    over_budget |= bool(leaks)
+    print(f"hm305.py loads server modules: {' '.join(leaks) if leaks else 'none'}")
+    if not args.skip_cli:
+        print(f"hm305.py --get        {cli_time(args.runs) * 1e3:7.1f} ms")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Load test for a running hm305p_server.py: requests per second as the number of clients grows.
+Each client holds one connection and sends its requests back to back.
+
+    python3 bench/load_test.py --port 9091 --clients 1 2 4 8 16 32 --cmd 'VOLT:SETP?'
+"""
+import argparse
+import socket
+import threading
+import time
+
+
+def client(host, port, cmd, requests, latencies, errors):
+    try:
+        with socket.create_connection((host, port)) as s:
+            f = s.makefile("rwb", buffering=0)
+            line = (cmd + "\n").encode()
+            for _ in range(requests):
+                t0 = time.perf_counter()
+                f.write(line)
+                resp = f.readline()
+                latencies.append(time.perf_counter() - t0)
+                if not resp or resp.startswith(b"error"):
+                    errors.append(resp)
+    except OSError as e:
+        errors.append(e)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(host, port, cmd, clients, requests):
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(
+            target=client, args=(host, port, cmd, requests, latencies, errors)
+        )
+        for _ in range(clients)
+    ]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--cmd", type=str, default="VOLT:SETP?", help="request to send")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests", type=int, default=100, help="requests per client")
+    args = parser.parse_args()
+
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for n in args.clients:
+        r = run(args.host, args.port, args.cmd, n, args.requests)
+        print(
+            f"{r['clients']:8d} {r['requests']:9d} {r['errors']:7d} "
+            f"{r['rps']:9.1f} {r['p50_ms']:8.2f} {r['p99_ms']:8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
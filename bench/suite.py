@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite against the simulated supply (hm305/simulator.py), so it
+runs anywhere, CI included. Measures:
+1. raw Modbus get_by_addr / set_by_addr transactions
+2. HM305 properties and FloatSetting.apply
+3. queue handler dispatch overhead, put to finish() on both queues
+4. HM305pServer requests per second and latency at 1, 10 and 100 clients
+
+Results are written as JSON. With --baseline, each result's ops_per_s is checked
+against an earlier run and the exit status is 1 if any fell by more than --tolerance.
+
+Run from the repo root:
+    python3 bench/suite.py --out bench.json
+    python3 bench/suite.py --baseline bench.json --quick
+"""
+import argparse
+import json
+import os
+import platform
+import socketserver
+import sys
+import threading
+import time
+from queue import Queue
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from load_test import percentile, run as load_run  # noqa: E402
+from hm305 import HM305  # noqa: E402
+from hm305.channel import Channel  # noqa: E402
+from hm305.queue_handler import HM305pSerialQueueHandler, HM305pFastQueueHandler  # noqa: E402
+from hm305.scheduler import SerialScheduler  # noqa: E402
+from hm305.server import HM305pServer, BoundedThreadingMixIn  # noqa: E402
+from hm305.server_commands import Command, SnapshotQuery  # noqa: E402
+from hm305.simulator import SimulatedSerial  # noqa: E402
+from modbus import Modbus  # noqa: E402
+
+
+def timed(fn, n: int) -> dict:
+    """Call fn n times; throughput and latency percentiles"""
+    latencies = []
+    t0 = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - t0
+    return summary(latencies, elapsed)
+
+
+def summary(latencies, elapsed: float) -> dict:
+    return {
+        "n": len(latencies),
+        "ops_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_us": percentile(latencies, 50) * 1e6,
+        "p90_us": percentile(latencies, 90) * 1e6,
+        "p99_us": percentile(latencies, 99) * 1e6,
+    }
+
+
+def bench_modbus(link: dict, n: int) -> dict:
+    modbus = Modbus(SimulatedSerial(**link))
+    return {
+        "modbus.get_by_addr": timed(lambda: modbus.get_by_addr(HM305.CMD.Voltage), n),
+        "modbus.set_by_addr": timed(lambda: modbus.set_by_addr(HM305.CMD.Set_Voltage, 500), n),
+        "modbus.read_registers_4": timed(lambda: modbus.read_registers(HM305.CMD.Voltage, 4), n),
+    }
+
+
+def bench_hm305(link: dict, n: int) -> dict:
+    hm = HM305(SimulatedSerial(**link))
+    hm.initialize()
+    hm.on()
+    setpoints = iter(range(n * 2))
+
+    def apply():
+        hm.voltage.setpoint = 1 + next(setpoints) % 20
+        hm.voltage.apply()
+
+    return {
+        "hm305.voltage.value": timed(lambda: hm.voltage.value, n),
+        "hm305.w": timed(lambda: hm.w, n),
+        "hm305.output": timed(lambda: hm.output, n),
+        "hm305.measure": timed(hm.measure, n),
+        "hm305.status": timed(hm.status, n),
+        "floatsetting.apply": timed(apply, n),
+    }
+
+
+class _Noop(Command):
+    """Costs nothing to invoke, so all that's measured is the queue"""
+
+    def invoke(self, hm):
+        self.complete = True
+
+
+def bench_queues(n: int) -> dict:
+    results = {}
+    for name, queue, handler in (
+        ("serial", SerialScheduler(), HM305pSerialQueueHandler),
+        ("fast", Queue(), HM305pFastQueueHandler),
+    ):
+        worker = threading.Thread(target=handler(queue, hm=None).run)
+        worker.daemon = True
+        worker.start()
+        latencies = []
+        t0 = time.perf_counter()
+        for _ in range(n):
+            cmd = _Noop()
+            cmd.uses_serial_port = name == "serial"
+            t = time.perf_counter()
+            queue.put(cmd)
+            cmd.wait()
+            latencies.append(time.perf_counter() - t)
+        results[f"queue_handler.{name}"] = summary(latencies, time.perf_counter() - t0)
+    return results
+
+
+class _BenchServer(BoundedThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+def bench_server(link: dict, clients, requests: int) -> dict:
+    SnapshotQuery.max_age = 0  # every VOLT? goes to the (simulated) port
+    channel = Channel("bench", HM305(SimulatedSerial(**link)))
+    channel.start()
+    HM305pServer.channels = {"bench": channel}
+    _BenchServer.max_clients = max(clients)
+    server = _BenchServer(("127.0.0.1", 0), HM305pServer)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    host, port = server.server_address
+    results = {}
+    try:
+        for cmd, label in (("VOLT:SETP?", "fast"), ("VOLT?", "serial")):
+            for n in clients:
+                r = load_run(host, port, cmd, n, requests)
+                results[f"server.{label}.{n}_clients"] = {
+                    "n": r["requests"],
+                    "errors": r["errors"],
+                    "ops_per_s": r["rps"],
+                    "p50_us": r["p50_ms"] * 1e3,
+                    "p99_us": r["p99_ms"] * 1e3,
+                }
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Names of results whose throughput fell more than tolerance below the baseline"""
+    slower = []
+    for name, base in baseline.get("results", {}).items():
+        now = results.get(name)
+        if now is not None and now["ops_per_s"] < base["ops_per_s"] * (1 - tolerance):
+            slower.append(f"{name}: {now['ops_per_s']:.1f}/s vs {base['ops_per_s']:.1f}/s")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baud", type=float, default=0,
+                        help="simulated link speed, 0 (the default) takes the link out of the measurement")
+    parser.add_argument("--turnaround", type=float, default=0.0, help="simulated device response delay, seconds")
+    parser.add_argument("-n", type=int, default=2000, help="iterations per in-process measurement")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--requests", type=int, default=50, help="requests per server client")
+    parser.add_argument("--quick", action="store_true", help="a tenth of the iterations, for a smoke test")
+    parser.add_argument("--out", type=str, help="write the JSON here instead of stdout")
+    parser.add_argument("--baseline", type=str, help="JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional throughput drop")
+    args = parser.parse_args()
+    if args.quick:
+        args.n = max(1, args.n // 10)
+        args.requests = max(1, args.requests // 10)
+
+    link = {"baudrate": args.baud or None, "turnaround": args.turnaround}
+    results = {}
+    results.update(bench_modbus(link, args.n))
+    results.update(bench_hm305(link, args.n))
+    results.update(bench_queues(args.n))
+    results.update(bench_server(link, args.clients, args.requests))
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "node": platform.node(),
+            "baud": args.baud,
+            "turnaround": args.turnaround,
+            "n": args.n,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for line in slower:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if slower else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,13 +5,18 @@ INC=${3}
 CMD=${2}
 HOST="10.2.0.9"
 
+# one connection for the whole script, the server answers each line with one line
+exec 3<>"/dev/tcp/$HOST/$PORT"
+
 SEND() {
-  echo "$@" | nc "$HOST" "$PORT"
+  echo "$@" >&3
+  read -r REPLY <&3
+  echo "$REPLY"
 }
 
 case "$CMD" in
 "VA")
-  V="$(bc <<< "scale=2; $(echo 'VOLT:SETP? ' | nc "$HOST" "$PORT")+$INC")"
+  V="$(bc <<< "scale=2; $(SEND 'VOLT:SETP?')+$INC")"
   SEND "VOLT $V"
   ;;
 "OUTPUT")
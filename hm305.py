@@ -1,13 +1,88 @@
 #!/usr/bin/python3
 
 import sys
+import time
 import serial
 import logging
 
 from hm305 import HM305
+from hm305.client import DaemonClient
+from hm305.datalog import DataLogger, RingBuffer
+from hm305.shm import ShmReader
 
 logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
 
+
+def given(args, *names) -> list:
+    """ The options among names that were given on the command line, as --flags """
+    return [
+        f"--{name.replace('_', '-')}"
+        for name in names
+        if getattr(args, name) is not None and getattr(args, name) is not False
+    ]
+
+
+def from_shm(args):
+    """ Report the readings a local hm305p_server.py --shm last published """
+    with ShmReader(args.from_shm) as reader:
+        sample = reader.read()
+    if sample is None:
+        logging.error(f"nothing published to {args.from_shm} yet")
+        sys.exit(1)
+    logging.info(f"{sample.voltage} Volts")
+    logging.info(f"{sample.current} Amps")
+    logging.info(f"{sample.power} Watts")
+    logging.info(f"Output {'ON' if sample.output else 'OFF'}")
+    logging.info(f"{time.time() - sample.wall_time:.3f} s old")
+
+
+def ask(daemon: DaemonClient, line: str) -> str:
+    """ daemon's response to line, exiting 1 if it, or any part of a ;-separated one, is an error """
+    resp = daemon.query(line)
+    if any(part.startswith("error") for part in resp.split(";")):
+        logging.error(f"{line}: {resp}")
+        sys.exit(1)
+    return resp
+
+
+def via_daemon(args):
+    """ Perform the requested actions through a running hm305p_server.py """
+    try:
+        with DaemonClient(args.via_daemon) as daemon:
+            if args.voltage is not None:
+                logging.info("Setting voltage:")
+                ask(daemon, f"VOLT {args.voltage}")
+            elif args.adj_voltage is not None:
+                logging.info("Adjusting voltage:")
+                setpoint = float(ask(daemon, "VOLT:SETP?"))
+                ask(daemon, f"VOLT {setpoint + args.adj_voltage:.3f}")
+            if args.current is not None:
+                logging.info("Setting current:")
+                ask(daemon, f"CURR {args.current}")
+            if args.beep:
+                logging.info("Setting beep: ON")
+                ask(daemon, "SYST:BEEP ON")
+            elif args.nobeep:
+                logging.info("Setting beep: OFF")
+                ask(daemon, "SYST:BEEP OFF")
+            if args.off:
+                logging.info("Setting output: OFF")
+                ask(daemon, "OUT OFF")
+            elif args.on:
+                logging.info("Setting output: ON")
+                ask(daemon, "OUT ON")
+            if args.get:
+                volts, amps, watts = ask(daemon, "VOLT?;CURR?;POW?").split(";")
+                logging.info(f"{volts} Volts")
+                logging.info(f"{amps} Amps")
+                logging.info(f"{watts} Watts")
+            if args.get_power:
+                logging.info(f"{ask(daemon, 'POW?')} Watts")
+    except OSError as e:  # no daemon listening, or it went away
+        logging.error(f"can't talk to hm305p_server.py on {args.via_daemon}: {e}")
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -15,6 +90,22 @@ if __name__ == "__main__":
 
     serial_parser = parser.add_mutually_exclusive_group(required=True)
     serial_parser.add_argument("--port", type=str, help="serial port")
+    serial_parser.add_argument(
+        "--via-daemon",
+        metavar="SOCKET",
+        nargs="?",
+        const=DaemonClient.DEFAULT_SOCKET,
+        help="go through a running hm305p_server.py --unix-socket instead of the serial port "
+        f"(default {DaemonClient.DEFAULT_SOCKET})",
+    )
+    serial_parser.add_argument(
+        "--from-shm",
+        metavar="PATH",
+        nargs="?",
+        const=ShmReader.DEFAULT_PATH,
+        help="report the latest readings published by hm305p_server.py --shm "
+        f"(default {ShmReader.DEFAULT_PATH})",
+    )
 
     volt_parser = parser.add_mutually_exclusive_group()
     volt_parser.add_argument("--voltage", type=float, help="set voltage")
@@ -46,6 +137,18 @@ if __name__ == "__main__":
         "--get-memory", action="store_true", help="get MEMORY key settings"
     )
     parser.add_argument("--info", action="store_true", help="get PSU info")
+    parser.add_argument(
+        "--log",
+        metavar="FILE",
+        type=str,
+        help="log V/I/P as fast as possible to FILE (.bin for binary, CSV otherwise)",
+    )
+    parser.add_argument(
+        "--log-duration", type=float, default=10.0, help="seconds to log for"
+    )
+    parser.add_argument(
+        "--log-capacity", type=int, default=1_000_000, help="samples kept in memory"
+    )
 
     def auto_int(x):
         return int(x, 0)
@@ -61,6 +164,22 @@ if __name__ == "__main__":
 
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
+    if args.from_shm:
+        unsupported = given(
+            args,
+            "voltage", "adj_voltage", "current", "on", "off", "beep", "nobeep",
+            "get_current_max", "get_voltage_max", "get_memory", "info", "log", "raw",
+        )
+        if unsupported:
+            parser.error(f"not available with --from-shm, which only reports readings: {' '.join(unsupported)}")
+        from_shm(args)
+        sys.exit(0)
+    if args.via_daemon:
+        unsupported = given(args, "get_current_max", "get_voltage_max", "get_memory", "info", "log", "raw")
+        if unsupported:
+            parser.error(f"not available with --via-daemon: {' '.join(unsupported)}")
+        via_daemon(args)
+        sys.exit(0)
     with serial.Serial(args.port, baudrate=9600, timeout=0.1) as ser:
         hm = HM305(ser)
         if args.voltage is not None:
@@ -68,10 +187,14 @@ if __name__ == "__main__":
             hm.voltage.instrument_setpoint = args.voltage
         elif args.adj_voltage is not None:
             logging.info("Adjusting voltage:")
-            hm.voltage.instrument_setpoint += args.adj_voltage
+            setpoint = hm.voltage.instrument_setpoint
+            if setpoint is None:
+                logging.error("reading the voltage setpoint failed")
+                sys.exit(1)
+            hm.voltage.instrument_setpoint = setpoint + args.adj_voltage
         if args.current is not None:
             logging.info("Setting current:")
-            hm.current.value = args.current
+            hm.current.instrument_setpoint = args.current
         if args.beep:
             logging.info("Setting beep: ON")
             hm.beep = 1
@@ -85,9 +208,13 @@ if __name__ == "__main__":
             logging.info("Setting output: ON")
             hm.on()
         if args.get:
-            logging.info(f"{hm.voltage.value} Volts")
-            logging.info(f"{hm.current.value} Amps")
-            logging.info(f"{hm.w} Watts")
+            m = hm.measure()
+            if m is None:
+                logging.error("measurement failed")
+                sys.exit(1)
+            logging.info(f"{m.voltage} Volts")
+            logging.info(f"{m.current} Amps")
+            logging.info(f"{m.power} Watts")
         if args.get_power:
             logging.info(f"{hm.w} Watts")
         if args.get_current_max:
@@ -111,7 +238,23 @@ if __name__ == "__main__":
                 f"class_details: {hex(hm.classdetail)}\n"
                 f"Device: {hm.device}"
             )
+        if args.log:
+            datalog = DataLogger(RingBuffer(args.log_capacity))
+            logging.info(f"Logging for {args.log_duration} s:")
+            try:
+                datalog.run(hm, args.log_duration)
+            except KeyboardInterrupt:
+                pass  # keep what we have
+            finally:
+                datalog.buffer.export(args.log)
+                logging.info(
+                    f"{datalog.buffer.appended} samples, {datalog.rate:.1f} samples/s, "
+                    f"{datalog.failed} failed, {len(datalog.buffer)} written to {args.log}"
+                )
         if args.raw:
             val = hm.modbus.get_by_addr(args.raw)
+            if val is None:
+                logging.error(f"reading {args.raw:#06x} failed")
+                sys.exit(1)
             logging.info(f"{args.raw: x}: {val} / {val: x}")
     logging.debug("Done")
@@ -1,12 +1,19 @@
 import logging
+from collections import namedtuple
 from enum import IntEnum, auto
+from typing import Optional
 import serial
 
 from modbus import Modbus
 from hm305.floatsetting import FloatSetting
+from hm305.preset import Preset, PresetMemory
 
 logger = logging.getLogger(__name__)
 
+Measurement = namedtuple("Measurement", "voltage current power")
+Protection = namedtuple("Protection", "voltage current power")
+Status = namedtuple("Status", "output protect_state")
+
 
 class HM305:
     class CMD(IntEnum):
@@ -112,6 +119,7 @@ class HM305:
             min_addr=HM305.CMD.Current_Min,
             max_addr=HM305.CMD.Current_Max,
         )
+        self.presets = PresetMemory(self.modbus, HM305.PRESET.Memory)
 
     def _set_val(self, addr: int, val) -> bool:
         return self.modbus.set_by_addr(addr, val)
@@ -119,14 +127,21 @@ class HM305:
     def _get_val(self, addr: int) -> int:
         return self.modbus.get_by_addr(addr)
 
+    def _get_vals(self, addr: int, count: int) -> Optional[tuple]:
+        return self.modbus.read_registers(addr, count)
+
+    def _set_vals(self, addr: int, vals) -> bool:
+        return self.modbus.write_registers(addr, vals)
+
     def _tx_rx_word(self, addr: int, val=None) -> int:
         if val is None:  # a getter
-            return (self._get_val(addr) << 16) + self._get_val(addr + 1)
+            vals = self._get_vals(addr, 2)
+            if vals is None:
+                return None
+            hi, lo = vals
+            return (hi << 16) + lo
         else:
-            a = self._set_val(addr, val >> 16)
-            if a:
-                return self._set_val(addr + 1, val & 0xFFFF)
-            return False
+            return self._set_vals(addr, (val >> 16, val & 0xFFFF))
 
     def initialize(self):
         # self.v_setpoint_sw = self._get_val(HM305.CMD.Set_Voltage) / 100
@@ -155,7 +170,40 @@ class HM305:
     ###########################################################
     @property
     def w(self):
-        return self._tx_rx_word(HM305.CMD.Power) / 1000
+        mw = self._tx_rx_word(HM305.CMD.Power)
+        return None if mw is None else mw / 1000
+
+    def measure(self) -> Optional[Measurement]:
+        """Voltage, current and power in a single block read, None if the read failed"""
+        vals = self._get_vals(HM305.CMD.Voltage, 4)
+        if vals is None:
+            return None
+        v, i, p_hi, p_lo = vals
+        return Measurement(
+            self.voltage.scale(v),
+            self.current.scale(i),
+            ((p_hi << 16) + p_lo) / 1000,
+        )
+
+    def status(self) -> Optional[Status]:
+        """Output and protection state in a single block read, None if the read failed"""
+        vals = self._get_vals(HM305.CMD.Output, 2)
+        if vals is None:
+            return None
+        return Status(*vals)
+
+    @property
+    def protection(self) -> Optional[Protection]:
+        """OVP, OCP and OPP thresholds in a single block read, None if the read failed"""
+        vals = self._get_vals(HM305.CMD.Protect_Voltage, 4)
+        if vals is None:
+            return None
+        v, i, p_hi, p_lo = vals
+        return Protection(
+            self.voltage.scale(v),
+            self.current.scale(i),
+            ((p_hi << 16) + p_lo) / 1000,
+        )
 
     @property
     def cmax(self):
@@ -206,21 +254,13 @@ class HM305:
     @property
     def memory(self):
         """ Return a dict of dicts for each [preset memory keys][registers] """
-        memory_values = HM305.PRESET.Memory
-        for key in HM305.PRESET.Memory:
-            memory_values[key]["Volts"] = (
-                self._get_val(HM305.PRESET.Memory[key]["Volts"]) / 100.0
-            )
-            memory_values[key]["Amps"] = (
-                self._get_val(HM305.PRESET.Memory[key]["Amps"]) / 1000.0
-            )
-            memory_values[key]["Time_span"] = self._get_val(
-                HM305.PRESET.Memory[key]["Time_span"]
-            )
-            memory_values[key]["Enabled"] = self._get_val(
-                HM305.PRESET.Memory[key]["Enabled"]
-            )
-        return memory_values
+        return {key: preset.as_dict() for key, preset in self.presets.read().items()}
+
+    def set_memory(self, key: str, volts: float, amps: float, time_span: int, enabled: int) -> bool:
+        """ Write a preset memory key, only touching registers that changed """
+        preset = Preset(volts, amps, time_span, enabled)
+        self.presets.write({key: preset})
+        return self.presets.snapshot(key) == preset
 
 
 def rint(x: float) -> int:
@@ -0,0 +1,59 @@
+import logging
+import threading
+from hm305.datalog import DataLogger, RingBuffer
+from hm305.queue_handler import HM305pSerialQueueHandler, HM305pFastQueueHandler
+from hm305.scheduler import SerialScheduler, FifoQueue
+from hm305.sequence import Sequence
+from hm305.telemetry import Telemetry, TelemetryPoller, StreamHub
+from hm305.writebehind import WriteBehind
+from modbus.metrics import ModbusMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class Channel:
+    """
+    One supply and everything that serves it: its HM305, its serial and fast queues
+    with a worker thread each, staged register writes, telemetry, streaming, the data logger and runtime metrics.
+    A server holds one Channel per serial port, so the ports are driven in parallel.
+    """
+
+    def __init__(self, name: str, hm, poll_rate: float = 0.0, log_capacity: int = 1_000_000):
+        self.name = name
+        self.hm = hm
+        hm.modbus.metrics = ModbusMetrics()
+        self.serial_q = SerialScheduler()
+        self.fast_q = FifoQueue()
+        self.writes = WriteBehind(self.serial_q)
+        self.serial_worker = HM305pSerialQueueHandler(self.serial_q, hm)
+        self.fast_worker = HM305pFastQueueHandler(self.fast_q, hm)
+        self.telemetry = Telemetry()
+        self.poller = TelemetryPoller(self.serial_q, self.telemetry, poll_rate)
+        self.streams = StreamHub(self.poller)
+        self.datalog = DataLogger(RingBuffer(log_capacity))
+        self.sequence = Sequence()
+        self.ramps = {}  # FloatSetting attribute name -> the latest hm305.ramp.Ramp on it
+
+    def start(self):
+        """Start the queue workers and the telemetry poller, as daemon threads"""
+        for target in (self.serial_worker.run, self.fast_worker.run, self.poller.run):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        logger.debug(f"channel {self.name} started")
+
+    def stats(self) -> dict:
+        """Everything the runtime metrics know about this channel, for SYST:STAT?"""
+        return {
+            "modbus": self.hm.modbus.metrics.as_dict(),
+            "serial_queue": self.serial_q.stats(),
+            "fast_queue": self.fast_q.stats(),
+            "write_behind": self.writes.stats(),
+            "stale_dropped": {
+                "serial": self.serial_worker.stale_dropped,
+                "fast": self.fast_worker.stale_dropped,
+            },
+        }
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.name}>"
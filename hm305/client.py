@@ -0,0 +1,41 @@
+import logging
+import socket
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonClient:
+    """
+    Talks to a running hm305p_server.py over its unix domain socket (--unix-socket),
+    so the daemon stays the only owner of the serial port.
+    """
+
+    DEFAULT_SOCKET = "/tmp/hm305.sock"
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=5.0):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self._f = self.sock.makefile("rwb", buffering=0)
+
+    def query(self, line: str) -> str:
+        """Send one command line and return the daemon's one line response"""
+        logger.debug(f"TX[{self.path}]: {line}")
+        self._f.write(f"{line}\n".encode())
+        resp = self._f.readline()
+        if not resp:
+            raise ConnectionError(f"{self.path} closed the connection")
+        resp = resp.decode().strip()
+        logger.debug(f"RX[{self.path}]: {resp}")
+        return resp
+
+    def close(self):
+        self._f.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
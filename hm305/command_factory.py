@@ -17,6 +17,24 @@ from hm305.server_commands import (
     OutputQuery,
     SetOutputCommand,
     CurrentApplyCommand,
+    BatchCommand,
+    MeasurePowerQuery,
+    BeepQuery,
+    SetBeepCommand,
+    StreamCommand,
+    LogCommand,
+    LogStatusQuery,
+    InstrumentSelectCommand,
+    InstrumentSelectQuery,
+    InstrumentCatalogQuery,
+    SystemStatsQuery,
+    VoltageRampCommand,
+    VoltageRampQuery,
+    CurrentRampCommand,
+    CurrentRampQuery,
+    SequenceCommand,
+    SequenceStatusQuery,
+    SequenceTimesQuery,
 )
 
 logger = logging.getLogger(__name__)
@@ -30,17 +48,56 @@ class CommandFactory:
                 dict, get=VoltageSetpointQuery, set=SetVoltageSetpointCommand
             ),
             "VOLTage:APPLY": partial(dict, get=None, set=VoltageApplyCommand),
+            "VOLTage:RAMP": partial(dict, get=VoltageRampQuery, set=VoltageRampCommand),
             "CURRent": partial(dict, get=MeasureCurrentQuery, set=SetCurrentCommand),
             "CURRent:SETPoint": partial(
                 dict, get=CurrentSetpointQuery, set=SetCurrentSetpointCommand
             ),
             "CURRent:APPLY": partial(dict, get=None, set=CurrentApplyCommand),
+            "CURRent:RAMP": partial(dict, get=CurrentRampQuery, set=CurrentRampCommand),
             "OUTput": partial(dict, get=OutputQuery, set=SetOutputCommand),
+            "POWer": partial(dict, get=MeasurePowerQuery, set=None),
+            "SYSTem:BEEPer": partial(dict, get=BeepQuery, set=SetBeepCommand),
+            "SYSTem:STATistics": partial(dict, get=SystemStatsQuery, set=None),
+            "MEASure:STREam": partial(dict, get=None, set=StreamCommand),
+            "LOG": partial(dict, get=LogStatusQuery, set=LogCommand),
+            "SEQuence": partial(dict, get=SequenceStatusQuery, set=SequenceCommand),
+            "SEQuence:TIMes": partial(dict, get=SequenceTimesQuery, set=None),
+            "INSTrument:SELect": partial(
+                dict, get=InstrumentSelectQuery, set=InstrumentSelectCommand
+            ),
+            "INSTrument:CATalog": partial(dict, get=InstrumentCatalogQuery, set=None),
         }
     )
 
+    @staticmethod
+    def _lookup(cmd_str: str):
+        """The get/set dict for a command header, or None if it isn't one of ours"""
+        scpi_cmd = CommandFactory.Commands.get(cmd_str)
+        if scpi_cmd is None:
+            logger.debug(f"unknown command: {cmd_str}")
+            return None
+        return scpi_cmd()
+
     @staticmethod
     def parse(cmd_str: str) -> Command:
+        if ";" in cmd_str:
+            return CommandFactory.parse_compound(cmd_str)
+        return CommandFactory.parse_single(cmd_str)
+
+    @staticmethod
+    def parse_compound(line: str) -> Command:
+        """A ;-separated line becomes one BatchCommand, or None if any part doesn't parse"""
+        msgs, _, _ = scpi.sanitize_msgs(line)
+        cmds = [CommandFactory.parse_single(msg) for msg in msgs]
+        if not cmds or None in cmds:
+            return None
+        if len(cmds) == 1:
+            return cmds[0]
+        return BatchCommand(cmds)
+
+    @staticmethod
+    def parse_single(cmd_str: str) -> Command:
         cmd_str = cmd_str.strip()  # remove whitespace
         is_query = cmd_str.endswith("?")
         cmd_str = cmd_str.strip("? ")
@@ -49,9 +106,9 @@ class CommandFactory:
             logger.debug(f"fixing cmd_str: {cmd_str}")
         num_spaces = cmd_str.count(" ")
         to_return = None
-        if num_spaces == 1:  # has arg
-            (cmd_str_base, arg_str) = cmd_str.split(" ")
-            scpi_cmd = CommandFactory.Commands[cmd_str_base]()
+        if num_spaces >= 1:  # has arg(s), the command decides what to make of them
+            (cmd_str_base, arg_str) = cmd_str.split(" ", 1)
+            scpi_cmd = CommandFactory._lookup(cmd_str_base)
             if scpi_cmd is not None:
                 if is_query and scpi_cmd["get"] is not None:
                     to_return = scpi_cmd["get"](arg_str)  # does this case exist?
@@ -59,8 +116,8 @@ class CommandFactory:
                     to_return = scpi_cmd["set"](arg_str)
             else:
                 to_return = None
-        elif num_spaces == 0:  # no arg
-            scpi_cmd = CommandFactory.Commands[cmd_str]()
+        else:  # no arg
+            scpi_cmd = CommandFactory._lookup(cmd_str)
             if scpi_cmd is not None:
                 if is_query and scpi_cmd["get"] is not None:
                     to_return = scpi_cmd["get"]()
@@ -68,6 +125,4 @@ class CommandFactory:
                     to_return = None  # scpi_cmd['set']()  # does this case exist? I don't think so
             else:
                 to_return = None
-        else:  # a problem
-            to_return = None
         return to_return
@@ -0,0 +1,195 @@
+import logging
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from modbus import CRCError
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    Fixed-capacity ring of fixed-width float records, all held in one preallocated
+    array.array('d'). Once full, the oldest records are overwritten.
+    The array is allocated by the first append, so an unused buffer costs nothing.
+    """
+
+    MAGIC = b"HM305LOG"
+    HEADER = struct.Struct("<8sHHQ")  # magic, version, record width, record count
+
+    def __init__(self, capacity: int, fields=("t", "voltage", "current", "power")):
+        self.fields = tuple(fields)
+        self.width = len(self.fields)
+        self.capacity = capacity
+        self.appended = 0  # total ever appended, including overwritten records
+        self._data = None
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def append(self, *values):
+        with self._lock:
+            data = self._data
+            if data is None:
+                data = self._data = array("d", bytes(8 * self.width * self.capacity))
+            i = self._next * self.width
+            for value in values:
+                data[i] = value
+                i += 1
+            self._next = (self._next + 1) % self.capacity
+            self.appended += 1
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self.appended = 0
+
+    def __len__(self):
+        return min(self.appended, self.capacity)
+
+    def records(self) -> array:
+        """A copy of the stored records, oldest first, flattened"""
+        with self._lock:
+            if self._data is None:
+                return array("d")
+            if self.appended <= self.capacity:
+                return self._data[: self.appended * self.width]
+            split = self._next * self.width
+            return self._data[split:] + self._data[:split]
+
+    def to_csv(self, f):
+        f.write(",".join(self.fields) + "\n")
+        data = self.records()
+        w = self.width
+        for i in range(0, len(data), w):
+            f.write(",".join(map(str, data[i:i + w])) + "\n")
+
+    def to_binary(self, f):
+        """HEADER, then the records as little-endian doubles"""
+        data = self.records()
+        f.write(self.HEADER.pack(self.MAGIC, 1, self.width, len(data) // self.width))
+        if sys.byteorder == "big":
+            data.byteswap()
+        data.tofile(f)
+
+    @classmethod
+    def read_binary(cls, f) -> array:
+        """Read back what to_binary wrote, as a flat array of width-sized records"""
+        magic, version, width, count = cls.HEADER.unpack(f.read(cls.HEADER.size))
+        if magic != cls.MAGIC:
+            raise ValueError(f"not an {cls.MAGIC.decode()} file")
+        data = array("d")
+        data.fromfile(f, width * count)
+        if sys.byteorder == "big":
+            data.byteswap()
+        return data
+
+    def export(self, path: str):
+        """Write the buffer to path, as binary if it ends in .bin, CSV otherwise"""
+        if path.endswith(".bin"):
+            with open(path, "wb") as f:
+                self.to_binary(f)
+        else:
+            with open(path, "w") as f:
+                self.to_csv(f)
+
+
+class DataLogger:
+    """
+    Samples V/I/P with one block read per sample into a RingBuffer,
+    as fast as the link allows. A sample whose read fails is counted and skipped.
+    """
+
+    def __init__(self, buffer: RingBuffer):
+        self.buffer = buffer
+        self.failed = 0  # samples lost to a failed or corrupted read
+        self.started = None
+        self.stopped = None
+        self._stop = threading.Event()
+        self._state_lock = threading.Lock()
+
+    def sample(self, hm) -> bool:
+        """Append one sample, False if the read failed and nothing was appended"""
+        try:
+            vals = hm.modbus.read_registers(hm.CMD.Voltage, 4)
+        except CRCError as e:
+            logger.debug(f"sample dropped: {e}")
+            vals = None
+        if vals is None:
+            self.failed += 1
+            return False
+        v, i, p_hi, p_lo = vals
+        self.buffer.append(
+            time.monotonic(),
+            hm.voltage.scale(v),
+            hm.current.scale(i),
+            ((p_hi << 16) + p_lo) / 1000,
+        )
+        return True
+
+    @property
+    def running(self) -> bool:
+        return self.started is not None and self.stopped is None
+
+    @property
+    def rate(self) -> float:
+        """Sustained samples per second since start"""
+        if self.started is None:
+            return 0.0
+        elapsed = (self.stopped or time.monotonic()) - self.started
+        return self.buffer.appended / elapsed if elapsed > 0 else 0.0
+
+    def _begin(self) -> bool:
+        with self._state_lock:
+            if self.running:
+                return False
+            self.buffer.clear()
+            self.failed = 0
+            self._stop = threading.Event()  # a new one per run, so a run still winding down can't be restarted
+            self.started = time.monotonic()
+            self.stopped = None
+            return True
+
+    def stop(self):
+        """Stop sampling; running is False as soon as this returns"""
+        with self._state_lock:
+            if self.running:
+                self.stopped = time.monotonic()
+            self._stop.set()
+
+    def run(self, hm, duration: float):
+        """Sample directly from hm for duration seconds (or until stop())"""
+        if not self._begin():
+            raise RuntimeError("already logging")
+        deadline = self.started + duration
+        stop = self._stop
+        try:
+            while not stop.is_set() and time.monotonic() < deadline:
+                self.sample(hm)
+        finally:
+            self.stop()
+
+    def start_queued(self, queue) -> bool:
+        """
+        Sample through the serial queue on a background thread until stop(),
+        one LogSampleCommand at a time, so interactive commands still get their
+        turn on the port. False if already running.
+        """
+        if not self._begin():
+            return False
+        logger_thread = threading.Thread(target=self._run_queued, args=(queue, self._stop))
+        logger_thread.daemon = True
+        logger_thread.start()
+        return True
+
+    def _run_queued(self, queue, stop: threading.Event):
+        # imported here so hm305.py --log, which samples directly, doesn't load the server side
+        from hm305.server_commands import LogSampleCommand
+
+        while not stop.is_set():
+            cmd = LogSampleCommand(self)
+            queue.put(cmd)
+            if not cmd.wait(5.0):
+                logger.error("log sample timed out")
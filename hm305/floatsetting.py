@@ -1,3 +1,5 @@
+from typing import Optional
+
 from modbus import Modbus
 
 
@@ -25,23 +27,41 @@ class FloatSetting:
         self.max_addr = max_addr
 
     def initialize(self):
-        self._sw_setpoint = self.instrument_setpoint
+        """Read the setpoint and limits from the instrument, keeping the defaults for any read that fails"""
+        self.instrument_setpoint  # updates setpoint when the read succeeds
         if self.min_addr is not None:
-            self.min = self._scaled_reading(self.min_addr)
+            reading = self._scaled_reading(self.min_addr)
+            if reading is not None:
+                self.min = reading
         if self.max_addr is not None:
-            self.max = self._scaled_reading(self.max_addr)
+            reading = self._scaled_reading(self.max_addr)
+            if reading is not None:
+                self.max = reading
 
-    def _scaled_reading(self, addr) -> float:
-        reading = self._modbus.get_by_addr(addr)
+    @property
+    def resolution(self) -> float:
+        """The smallest setpoint change the instrument can represent"""
+        return 1.0 / self._value_scalar
+
+    def scale(self, reading: int) -> float:
+        """Convert a raw register reading into engineering units"""
         return reading / self._value_scalar
 
-    def _scaled_int_writing(self, addr: int, value: float) -> bool:
+    def _scaled_reading(self, addr) -> Optional[float]:
+        """None if the read failed"""
+        reading = self._modbus.get_by_addr(addr)
+        return None if reading is None else self.scale(reading)
+
+    def register_value(self, value: float) -> int:
+        """value clamped to min/max, in the instrument's integer units"""
         if value < self.min:
             value = self.min
         elif value > self.max:
             value = self.max
-        value = int(round(value * self._value_scalar))
-        return self._modbus.set_by_addr(addr, value)
+        return int(round(value * self._value_scalar))
+
+    def _scaled_int_writing(self, addr: int, value: float) -> bool:
+        return self._modbus.set_by_addr(addr, self.register_value(value))
 
     @property
     def setpoint(self) -> float:
@@ -53,20 +73,32 @@ class FloatSetting:
         self._sw_setpoint = to_set  # todo this should be atomic
 
     @property
-    def instrument_setpoint(self) -> float:
+    def instrument_setpoint(self) -> Optional[float]:
+        """The setpoint read back from the instrument, None (leaving setpoint alone) if the read failed"""
         got = self._scaled_reading(self._setpoint_address)
+        if got is None:
+            return None
         self.setpoint = got
         self._setpoint_out_of_sync = False
         return got
 
     @instrument_setpoint.setter
     def instrument_setpoint(self, to_set: float):
+        self.write(to_set)
+
+    def write(self, to_set: float) -> bool:
+        """
+        Write to_set to the instrument's setpoint register. True if the instrument
+        acknowledged it; setpoint only takes the new value then.
+        """
+        if not self._scaled_int_writing(self._setpoint_address, to_set):
+            return False
         self.setpoint = to_set
-        self._scaled_int_writing(self._setpoint_address, self.setpoint)
         self._setpoint_out_of_sync = False
+        return True
 
     @property
-    def value(self) -> float:
+    def value(self) -> Optional[float]:
         return self._scaled_reading(self._value_address)
 
     def increment(self, inc: float):
@@ -0,0 +1,97 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from modbus.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def _histogram(lines: list, name: str, histogram: Histogram, **labels):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+
+def prometheus(channels: dict) -> str:
+    """The runtime metrics of every channel (name -> hm305.channel.Channel), in Prometheus text format"""
+    lines = [
+        "# TYPE hm305_modbus_latency_seconds histogram",
+        "# TYPE hm305_modbus_register_latency_seconds histogram",
+        "# TYPE hm305_modbus_crc_errors_total counter",
+        "# TYPE hm305_modbus_timeouts_total counter",
+        "# TYPE hm305_modbus_exceptions_total counter",
+        "# TYPE hm305_queue_depth gauge",
+        "# TYPE hm305_queue_wait_seconds histogram",
+        "# TYPE hm305_queue_expired_total counter",
+        "# TYPE hm305_queue_coalesced_total counter",
+        "# TYPE hm305_stale_dropped_total counter",
+        "# TYPE hm305_write_behind_staged_total counter",
+        "# TYPE hm305_write_behind_overwritten_total counter",
+        "# TYPE hm305_write_behind_transactions_total counter",
+    ]
+    for name, channel in channels.items():
+        metrics = channel.hm.modbus.metrics
+        for fn, histogram in list(metrics.by_function.items()):
+            _histogram(lines, "hm305_modbus_latency_seconds", histogram, channel=name, function=f"{fn:#04x}")
+        for reg, histogram in list(metrics.by_register.items()):
+            _histogram(
+                lines, "hm305_modbus_register_latency_seconds", histogram, channel=name, register=f"{reg:#06x}"
+            )
+        lines.append(f"hm305_modbus_crc_errors_total{_labels(channel=name)} {metrics.crc_errors}")
+        lines.append(f"hm305_modbus_timeouts_total{_labels(channel=name)} {metrics.timeouts}")
+        lines.append(f"hm305_modbus_exceptions_total{_labels(channel=name)} {metrics.exceptions}")
+        for queue_name, queue in (("serial", channel.serial_q), ("fast", channel.fast_q)):
+            for cls, stats in queue.class_stats().items():
+                labels = {"channel": name, "queue": queue_name, "class": cls}
+                lines.append(f"hm305_queue_depth{_labels(**labels)} {stats.depth}")
+                lines.append(f"hm305_queue_expired_total{_labels(**labels)} {stats.expired}")
+                lines.append(f"hm305_queue_coalesced_total{_labels(**labels)} {stats.coalesced}")
+                _histogram(lines, "hm305_queue_wait_seconds", stats.wait, **labels)
+        for queue_name, worker in (("serial", channel.serial_worker), ("fast", channel.fast_worker)):
+            lines.append(f"hm305_stale_dropped_total{_labels(channel=name, queue=queue_name)} {worker.stale_dropped}")
+        writes = channel.writes
+        lines.append(f"hm305_write_behind_staged_total{_labels(channel=name)} {writes.staged}")
+        lines.append(f"hm305_write_behind_overwritten_total{_labels(channel=name)} {writes.overwritten}")
+        lines.append(f"hm305_write_behind_transactions_total{_labels(channel=name)} {writes.transactions}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves prometheus(channels) at /metrics"""
+
+    channels = {}
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus(self.channels).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve_metrics(address: tuple, channels: dict) -> ThreadingHTTPServer:
+    """Start the Prometheus endpoint on a daemon thread"""
+    MetricsHandler.channels = channels
+    server = ThreadingHTTPServer(address, MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info(f"prometheus metrics on http://{address[0]}:{address[1]}/metrics")
+    return server
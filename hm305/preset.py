@@ -0,0 +1,130 @@
+import logging
+from typing import Dict, Optional, Tuple
+
+from modbus import Modbus
+
+logger = logging.getLogger(__name__)
+
+
+class Preset:
+    """ Values of one M1 - M6 memory key, in engineering units """
+
+    VOLTS_SCALAR = 100.0
+    AMPS_SCALAR = 1000.0
+
+    def __init__(self, volts=0.0, amps=0.0, time_span=0, enabled=0):
+        self.volts = volts
+        self.amps = amps
+        self.time_span = time_span
+        self.enabled = enabled
+
+    @classmethod
+    def from_registers(cls, regs: Tuple[int, ...]) -> "Preset":
+        volts, amps, time_span, enabled = regs
+        return cls(
+            volts / cls.VOLTS_SCALAR, amps / cls.AMPS_SCALAR, time_span, enabled
+        )
+
+    def to_registers(self) -> Tuple[int, ...]:
+        return (
+            int(round(self.volts * self.VOLTS_SCALAR)),
+            int(round(self.amps * self.AMPS_SCALAR)),
+            int(self.time_span),
+            int(self.enabled),
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "Volts": self.volts,
+            "Amps": self.amps,
+            "Time_span": self.time_span,
+            "Enabled": self.enabled,
+        }
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Preset) and self.to_registers() == other.to_registers()
+        )
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}({self.volts}V, {self.amps}A, "
+            f"{self.time_span}s, enabled={self.enabled})>"
+        )
+
+
+class PresetMemory:
+    """
+    Reads the preset memory keys with one block read per bank, and writes back
+    only the registers that differ from the last snapshot read from (or written to) the device
+    """
+
+    REGISTERS_PER_BANK = 4
+
+    def __init__(self, modbus: Modbus, memory_map: dict):
+        """
+        :param modbus: the Modbus link to the supply
+        :param memory_map: {key: {"Volts": addr, ...}} as in HM305.PRESET.Memory
+        """
+        self._modbus = modbus
+        self._base = {key: regs["Volts"] for key, regs in memory_map.items()}
+        self._snapshot: Dict[str, Tuple[int, ...]] = {}
+
+    def keys(self):
+        return self._base.keys()
+
+    def snapshot(self, key: str) -> Optional[Preset]:
+        """What we last read from or wrote to the device for key, without a transaction"""
+        regs = self._snapshot.get(key)
+        return None if regs is None else Preset.from_registers(regs)
+
+    def read(self) -> Dict[str, Preset]:
+        """Every key that could be read; one whose read failed is left out"""
+        presets = {}
+        for key, base in self._base.items():
+            regs = self._modbus.read_registers(base, self.REGISTERS_PER_BANK)
+            if regs is None:
+                logger.error(f"reading {key} failed")
+                self._snapshot.pop(key, None)  # unknown state, write it all next time
+                continue
+            self._snapshot[key] = regs
+            presets[key] = Preset.from_registers(regs)
+        return presets
+
+    def write(self, presets: Dict[str, Preset]) -> int:
+        """
+        Write presets back, skipping registers that already hold the right value.
+        Returns the number of transactions used.
+        """
+        transactions = 0
+        for key, preset in presets.items():
+            base = self._base[key]
+            new = preset.to_registers()
+            span = self._changed_span(self._snapshot.get(key), new)
+            if span is None:
+                logger.debug(f"{key} unchanged")
+                continue
+            first, last = span
+            if first == last:
+                ok = self._modbus.set_by_addr(base + first, new[first])
+            else:
+                ok = self._modbus.write_registers(base + first, new[first:last + 1])
+            transactions += 1
+            if ok:
+                self._snapshot[key] = new
+            else:
+                logger.error(f"writing {key} {preset} failed")
+                self._snapshot.pop(key, None)  # unknown state, write it all next time
+        return transactions
+
+    @staticmethod
+    def _changed_span(
+        old: Optional[Tuple[int, ...]], new: Tuple[int, ...]
+    ) -> Optional[Tuple[int, int]]:
+        """First and last index that differ, or None if nothing does"""
+        if old is None:
+            return 0, len(new) - 1
+        changed = [i for i, (a, b) in enumerate(zip(old, new)) if a != b]
+        if not changed:
+            return None
+        return changed[0], changed[-1]
@@ -6,28 +6,47 @@ from modbus import CRCError
 logger = logging.getLogger(__name__)
 
 
-class HM305pSerialQueueHandler:  # todo priority queue? monitoring commands for i3bar are much less important
+def _invoke(item, hm):
+    """
+    Run item, turning whatever it raises into an error result, so one bad
+    command or reply can't take the worker thread (and the channel) down with it
+    """
+    try:
+        item.invoke(hm)
+    except CRCError as e:
+        logger.error(f"{item}: CRC error {e}")
+        item.result = "error: CRC"
+    except Exception as e:
+        logger.exception(f"{item} failed")
+        item.result = f"error: {e.__class__.__name__}"
+
+
+class HM305pSerialQueueHandler:
     time_to_die = False
 
     def __init__(self, queue, hm):
         self.queue = queue
         self.hm = hm
+        self.stale_dropped = 0
 
     def run(self):
         while not self.time_to_die:
             try:
                 item = self.queue.get(timeout=1)
+            except Empty:
+                continue
+            try:
                 if item.stale:
                     logger.debug(f"stale item! {item}")
+                    self.stale_dropped += 1
                 else:
                     logger.debug(f"processing {item}")
-                    try:
-                        item.invoke(self.hm)
-                    except CRCError as e:
-                        logger.error(e)
+                    _invoke(item, self.hm)
+            finally:
+                item.finish()
+                for _ in item.followers:
+                    self.queue.task_done()
                 self.queue.task_done()
-            except Empty:
-                continue
 
 
 class HM305pFastQueueHandler:
@@ -36,13 +55,18 @@ class HM305pFastQueueHandler:
     def __init__(self, queue, hm):
         self.queue = queue
         self.hm = hm
+        self.stale_dropped = 0
 
     def run(self):
         while not self.time_to_die:
             try:
                 item = self.queue.get(timeout=1)
+            except Empty:
+                continue
+            try:
                 if item.stale:
                     logger.debug(f"stale item! {item}")
+                    self.stale_dropped += 1
                 elif item.uses_serial_port:
                     logger.error(
                         f"Bad programmer! You cannot put {item} in the fast queue!"
@@ -50,7 +74,7 @@ class HM305pFastQueueHandler:
                     item.result = "QUEUE ERROR"
                 else:
                     logger.debug(f"processing {item}")
-                    item.invoke(self.hm)
+                    _invoke(item, self.hm)
+            finally:
+                item.finish()
                 self.queue.task_done()
-            except Empty:
-                continue
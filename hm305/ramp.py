@@ -0,0 +1,124 @@
+import logging
+import math
+import threading
+import time
+
+from hm305.floatsetting import FloatSetting
+from hm305.server_commands import RampStepCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Ramp:
+    """
+    Moves a FloatSetting's setpoint to target at rate units per second.
+    A driver thread puts one RampStepCommand at a time in the serial queue, so anything
+    more urgent (output off) still gets the port between steps. Each step writes the
+    value the ramp should have reached by time.monotonic() at that moment, so queueing
+    delays never accumulate into the ramp. Steps go out as fast as the link turns them
+    around, but no faster than the setpoint can change by one count.
+    """
+
+    step_timeout = 5.0
+    read_attempts = 3  # tries at reading the starting setpoint before the ramp fails
+
+    def __init__(self, setting: FloatSetting, target: float, rate: float):
+        self.setting = setting
+        self.target = target
+        self.rate = rate
+        self.start_value = None
+        self.value = None
+        self.started = None
+        self.finished = None
+        self.stopped = None  # finished, cancelled or failed
+        self.failed = False
+        self.steps = 0
+        self._cancel = threading.Event()
+
+    @property
+    def state(self) -> str:
+        if self.finished is not None:
+            return "DONE"
+        if self.failed:
+            return "FAILED"
+        if self._cancel.is_set():
+            return "CANCELLED"
+        return "RUNNING"
+
+    @property
+    def progress(self) -> float:
+        """0 to 1, how far along the ramp the setpoint is"""
+        if self.value is None:
+            return 0.0
+        span = self.target - self.start_value
+        return abs(self.value - self.start_value) / abs(span) if span else 1.0
+
+    def status(self) -> str:
+        """state,setpoint,target,progress,steps,seconds"""
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.stopped or time.monotonic()) - self.started
+        value = self.value if self.value is not None else float("nan")
+        return f"{self.state},{value:.3f},{self.target:.3f},{self.progress:.3f},{self.steps},{elapsed:.3f}"
+
+    def start(self, queue):
+        ramp_thread = threading.Thread(target=self._run, args=(queue,))
+        ramp_thread.daemon = True
+        ramp_thread.start()
+
+    def cancel(self):
+        """Stop at the current setpoint, a step that's already queued does nothing"""
+        if self.stopped is None:
+            self.stopped = time.monotonic()
+        self._cancel.set()
+
+    def step(self):
+        """Called on the serial worker through a RampStepCommand"""
+        if self._cancel.is_set() or self.finished is not None:
+            return
+        if self.started is None:  # first step reads where we start from
+            for _ in range(self.read_attempts):
+                start_value = self.setting.instrument_setpoint
+                if start_value is not None:
+                    break
+            else:
+                logger.error("ramp couldn't read the starting setpoint")
+                self._fail()
+                return
+            self.start_value = self.value = start_value
+            self.started = time.monotonic()
+            return
+        now = time.monotonic()
+        span = self.target - self.start_value
+        travel = min(abs(span), self.rate * (now - self.started))
+        value = self.start_value + math.copysign(travel, span)
+        if not self.setting.write(value):
+            logger.error(f"ramp step to {value:.3f} not acknowledged, stopping at {self.value}")
+            self._fail()
+            return
+        self.value = value
+        self.steps += 1
+        if travel >= abs(span):
+            self.finished = self.stopped = time.monotonic()
+
+    def _fail(self):
+        self.failed = True
+        self.cancel()
+
+    def _run(self, queue):
+        interval = self.setting.resolution / self.rate  # time for the setpoint to move one count
+        next_step = time.monotonic()
+        while self.finished is None:
+            delay = next_step - time.monotonic()
+            if self._cancel.wait(max(delay, 0)):
+                break
+            cmd = RampStepCommand(self)
+            queue.put(cmd)
+            if not cmd.wait(self.step_timeout):
+                logger.error(f"ramp step timed out, giving up at {self.value}")
+                cmd.stale = True
+                self._fail()
+                break
+            # behind schedule means the link is the limit, so go again straight away
+            next_step = max(next_step + interval, time.monotonic())
+        logger.debug(f"ramp {self.status()}")
@@ -0,0 +1,166 @@
+import heapq
+import itertools
+import time
+from collections import deque
+from enum import IntEnum
+from queue import Queue
+
+from modbus.metrics import Histogram
+
+
+class Priority(IntEnum):
+    """Lower values are served first"""
+
+    SAFETY = 0  # output off
+    SETPOINT = 1  # applying voltage/current setpoints
+    INTERACTIVE = 2  # queries a client is waiting on
+    MONITORING = 3  # background polling
+
+
+class ClassStats:
+    def __init__(self):
+        self.depth = 0
+        self.max_depth = 0
+        self.dispatched = 0
+        self.expired = 0
+        self.coalesced = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.wait = Histogram()
+
+    def waited(self, wait: float):
+        self.dispatched += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.wait.observe(wait)
+
+    def as_dict(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "dispatched": self.dispatched,
+            "expired": self.expired,
+            "coalesced": self.coalesced,
+            "mean_wait": self.total_wait / self.dispatched if self.dispatched else 0.0,
+            "p99_wait": self.wait.quantile(0.99),
+            "max_wait": self.max_wait,
+        }
+
+
+class SerialScheduler(Queue):
+    """
+    A drop-in replacement for the FIFO serial queue.
+    Items come out by Priority class, FIFO within a class.
+    Items whose deadline has passed by the time they come out are marked stale,
+    so the queue handler drops them without touching the port.
+
+    Reads of the same register that are still waiting are coalesced: later
+    ones are attached to the first as followers instead of being queued,
+    and the queue handler copies the result to them (see Command.finish).
+    Followers still count towards join(); the handler calls task_done() for each.
+
+    Items are expected to have `priority`, `max_wait`, `deadline`, `read_register`
+    and `followers` attributes (see Command).
+    A deadline is filled in from max_wait at put() time if the item doesn't have one yet.
+    """
+
+    def _init(self, maxsize):
+        self.queue = []
+        self._seq = itertools.count()
+        self._stats = {p: ClassStats() for p in Priority}
+        self._waiting_reads = {}
+
+    def _qsize(self):
+        return len(self.queue)
+
+    @staticmethod
+    def _read_key(item):
+        if item.read_register is None:
+            return None
+        return type(item), item.read_register
+
+    def _put(self, item):
+        now = time.monotonic()
+        key = self._read_key(item)
+        leader = self._waiting_reads.get(key) if key is not None else None
+        if leader is not None and not leader.stale:
+            leader.followers.append(item)
+            self._stats[item.priority].coalesced += 1
+            return
+        if key is not None:
+            self._waiting_reads[key] = item
+        if item.deadline is None and item.max_wait is not None:
+            item.deadline = now + item.max_wait
+        heapq.heappush(self.queue, (item.priority, next(self._seq), now, item))
+        stats = self._stats[item.priority]
+        stats.depth += 1
+        stats.max_depth = max(stats.max_depth, stats.depth)
+
+    def _get(self):
+        priority, _, enqueued, item = heapq.heappop(self.queue)
+        key = self._read_key(item)
+        if key is not None and self._waiting_reads.get(key) is item:
+            del self._waiting_reads[key]  # now in flight, later reads start a new group
+        now = time.monotonic()
+        stats = self._stats[priority]
+        stats.depth -= 1
+        if item.deadline is not None and now > item.deadline:
+            item.stale = True
+            stats.expired += 1
+        else:
+            stats.waited(now - enqueued)
+        return item
+
+    def abandon(self, item):
+        """
+        The client waiting on item gave up. Drop it, unless reads coalesced into it
+        are still waiting on it: they didn't time out, and it runs for them.
+        """
+        with self.mutex:
+            if not item.followers:
+                item.stale = True
+
+    def stats(self) -> dict:
+        """Depth and wait time statistics per priority class"""
+        with self.mutex:
+            return {p.name: s.as_dict() for p, s in self._stats.items()}
+
+    def class_stats(self) -> dict:
+        """The live ClassStats per priority class name"""
+        return {p.name: s for p, s in self._stats.items()}
+
+
+class FifoQueue(Queue):
+    """A plain FIFO queue that keeps the same depth and wait statistics as SerialScheduler"""
+
+    def _init(self, maxsize):
+        self.queue = deque()
+        self._stats = ClassStats()
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        self.queue.append((time.monotonic(), item))
+        stats = self._stats
+        stats.depth += 1
+        stats.max_depth = max(stats.max_depth, stats.depth)
+
+    def _get(self):
+        enqueued, item = self.queue.popleft()
+        self._stats.depth -= 1
+        self._stats.waited(time.monotonic() - enqueued)
+        return item
+
+    def abandon(self, item):
+        """The client waiting on item gave up, drop it if it's still queued"""
+        item.stale = True
+
+    def stats(self) -> dict:
+        """Depth and wait time statistics, in the same shape as SerialScheduler.stats()"""
+        with self.mutex:
+            return {"FIFO": self._stats.as_dict()}
+
+    def class_stats(self) -> dict:
+        """The live ClassStats, in the same shape as SerialScheduler.class_stats()"""
+        return {"FIFO": self._stats}
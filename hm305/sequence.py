@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from typing import Optional
+
+from hm305 import HM305
+from hm305.datalog import RingBuffer
+from hm305.server_commands import SequenceStepCommand
+
+logger = logging.getLogger(__name__)
+
+Step = namedtuple("Step", "voltage current output dwell")
+
+
+class Sequence:
+    """
+    A list of Steps run through the serial queue, optionally looped.
+    Step k of a loop is due at the run's start time plus the dwells before it, on
+    time.monotonic(), so lateness never accumulates from one step to the next. Each
+    step is queued `lead` seconds early, and lead tracks how long a step takes to get
+    through the queue and onto the supply, so the settings land on schedule.
+    When each step took effect is kept in a RingBuffer, for SEQ:TIMes? and SEQ EXPORT.
+    """
+
+    max_steps = 10000
+    step_timeout = 5.0
+    lead_gain = 0.5  # fraction of each step's lateness taken off the next step's queueing time
+    max_lead = 1.0
+
+    def __init__(self, capacity: int = 100_000):
+        self.steps = []
+        self.times = RingBuffer(capacity, fields=("loop", "step", "scheduled", "actual"))
+        self.loops = 1
+        self.loop = 0
+        self.index = 0
+        self.started = None
+        self.stopped = None
+        self.failed = False
+        self.worst_late = 0.0
+        self.lead = 0.0
+        self._written = None  # (setpoint registers, output) the supply was last given
+        self._stop = threading.Event()
+        self._state_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.started is not None and self.stopped is None
+
+    @property
+    def state(self) -> str:
+        if self.started is None:
+            return "IDLE"
+        if self.stopped is None:
+            return "RUNNING"
+        if self.failed:
+            return "FAILED"
+        return "STOPPED" if self._stop.is_set() else "DONE"
+
+    def status(self) -> str:
+        """state,loop,step,steps,worst lateness in ms"""
+        return f"{self.state},{self.loop},{self.index},{len(self.steps)},{self.worst_late * 1e3:.1f}"
+
+    def last_loop_times(self) -> list:
+        """When each step of the most recent loop took effect, seconds from the start"""
+        data = self.times.records()
+        width = self.times.width
+        times = []
+        for i in range(len(data) - width, -1, -width):
+            if data[i] != data[-width]:  # an earlier loop
+                break
+            times.append(data[i + 3])
+        return times[::-1]
+
+    def add(self, step: Step) -> bool:
+        """Append a step, False while running or when full"""
+        with self._state_lock:
+            if self.running or len(self.steps) >= self.max_steps:
+                return False
+            self.steps.append(step)
+            return True
+
+    def clear(self) -> bool:
+        with self._state_lock:
+            if self.running:
+                return False
+            self.steps = []
+            return True
+
+    def start(self, queue, loops: int = 1) -> bool:
+        """Run on a background thread, loops times (0 for until stop()). False if already running."""
+        with self._state_lock:
+            if self.running or not self.steps:
+                return False
+            self.loops = loops
+            self.loop = self.index = 0
+            self.times.clear()
+            self.failed = False
+            self.worst_late = self.lead = 0.0
+            self._written = None
+            self._stop.clear()
+            self.started = time.monotonic()
+            self.stopped = None
+        sequence_thread = threading.Thread(target=self._run, args=(queue, list(self.steps)))
+        sequence_thread.daemon = True
+        sequence_thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def apply(self, hm, step: Step) -> Optional[float]:
+        """
+        Called on the serial worker through a SequenceStepCommand: give the supply the
+        step's settings, writing only what changed since the previous step, with both
+        setpoints in one transaction. Output goes off before the setpoints change and
+        on after. Returns the time.monotonic() the last write finished, or None if the
+        supply didn't acknowledge a write, which fails the sequence.
+        """
+        setpoints = (hm.voltage.register_value(step.voltage), hm.current.register_value(step.current))
+        last_setpoints, last_output = self._written or (None, None)
+        self._written = None  # unknown until every write below is acknowledged
+        if step.output != last_output and not step.output:
+            if not hm.modbus.set_by_addr(HM305.CMD.Output, 0):
+                logger.error(f"sequence step {step}: output off not acknowledged")
+                return None
+        if setpoints != last_setpoints:
+            if not hm.modbus.write_registers(HM305.CMD.Set_Voltage, setpoints):
+                logger.error(f"sequence step {step}: setpoints not acknowledged")
+                return None
+            hm.voltage.setpoint = step.voltage
+            hm.current.setpoint = step.current
+        if step.output != last_output and step.output:
+            if not hm.modbus.set_by_addr(HM305.CMD.Output, 1):
+                logger.error(f"sequence step {step}: output on not acknowledged")
+                return None
+        self._written = (setpoints, step.output)
+        return time.monotonic()
+
+    def _run(self, queue, steps):
+        start = time.monotonic()
+        due = start
+        try:
+            while self.loops == 0 or self.loop < self.loops:
+                for index, step in enumerate(steps):
+                    self.index = index
+                    if self._stop.wait(max(due - self.lead - time.monotonic(), 0)):
+                        return
+                    cmd = SequenceStepCommand(self, step)
+                    queue.put(cmd)
+                    if not cmd.wait(self.step_timeout) or cmd.applied is None:
+                        logger.error(f"sequence step {self.loop}:{index} didn't complete, stopping")
+                        cmd.stale = True
+                        self.failed = True
+                        return
+                    late = cmd.applied - due
+                    self.worst_late = max(self.worst_late, late)
+                    self.lead = min(max(self.lead + self.lead_gain * late, 0.0), self.max_lead)
+                    self.times.append(self.loop, index, due - start, cmd.applied - start)
+                    due += step.dwell
+                self.loop += 1
+        finally:
+            self.stopped = time.monotonic()
+            logger.debug(f"sequence {self.status()}")
@@ -1,8 +1,17 @@
+import json
 import logging
+import os
+import socket
 import socketserver
-from typing import Any
+import threading
+import time
+from functools import partial
+from queue import Queue
+from typing import Any, Callable
 
 from hm305.command_factory import CommandFactory
+from hm305.ramp import Ramp
+from hm305.sequence import Step
 from hm305.server_commands import (
     SetVoltageCommand,
     SetVoltageSetpointCommand,
@@ -11,6 +20,19 @@ from hm305.server_commands import (
     SetCurrentCommand,
     SetCurrentSetpointCommand,
     CurrentApplyCommand,
+    StreamCommand,
+    LogCommand,
+    LogStatusQuery,
+    InstrumentSelectCommand,
+    InstrumentSelectQuery,
+    InstrumentCatalogQuery,
+    SystemStatsQuery,
+    RampCommand,
+    RampQuery,
+    SequenceCommand,
+    SequenceStatusQuery,
+    SequenceTimesQuery,
+    BatchCommand,
 )
 
 logger = logging.getLogger(__name__)
@@ -23,56 +45,359 @@ class HM305pSerialQueueItem:
         self.result = None
 
 
+class BoundedThreadingMixIn(socketserver.ThreadingMixIn):
+    """
+    Serve each connection on its own thread, with at most max_clients at once.
+    When all slots are busy the accept loop waits for one to free up.
+    """
+
+    daemon_threads = True
+    block_on_close = False
+    max_clients = 64
+    request_queue_size = 128  # listen() backlog, socketserver's default of 5 drops bursts of connects
+    _slots = None
+
+    def process_request(self, request, client_address):
+        if self._slots is None:
+            self._slots = threading.BoundedSemaphore(self.max_clients)
+        self._slots.acquire()
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+
 class HM305pServer(socketserver.StreamRequestHandler):
     most_recent_voltage_cmd = None
-    serial_q = None
-    fast_q = None
+    channels = {}  # name -> hm305.channel.Channel, the first one is selected on connect
+    log_dir = "."  # LOG EXPORT only writes here
     command_factory = CommandFactory()
+    result_timeout = 5.0  # seconds to wait for a queued command before giving up
+    timeout = 30.0  # idle timeout, a connection with no new line for this long is closed
 
     def __init__(
         self, request: Any, client_address: Any, base_server: socketserver.BaseServer
     ):
         super().__init__(request, client_address, base_server)
 
+    @property
+    def peer(self) -> str:
+        # unix domain socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _wait(self, item: Command, queue) -> bool:
+        """Wait for the queue item was put in to finish it, abandoning it on timeout"""
+        if item.wait(HM305pServer.result_timeout):
+            return True
+        logger.error(f"timed out waiting on {item}")
+        queue.abandon(item)  # if it's still queued, don't bother running it
+        return False
+
     def handle(self):
-        resp = ""
-        msg = self.rfile.readline().strip().decode()
-        logger.debug(f"REQ[{self.client_address[0]}]: {msg}")
+        """
+        Serve newline-delimited commands until the client closes the connection
+        or goes quiet for `timeout` seconds (never while it is streaming).
+        Commands can be pipelined: each line is queued as soon as it's read, and a
+        writer thread sends the responses back in request order, one line each.
+        """
+        self._rbuf = bytearray()
+        self._stream_stops = []
+        self.channel = next(iter(HM305pServer.channels.values()), None)
+        responses = Queue()
+        writer = threading.Thread(target=self._write_responses, args=(responses,))
+        writer.daemon = True
+        writer.start()
+        try:
+            while True:
+                try:
+                    line = self._readline()
+                except socket.timeout:
+                    if any(not stop.is_set() for stop in self._stream_stops):
+                        continue
+                    logger.debug(f"closing idle connection from {self.peer}")
+                    break
+                if not line:
+                    break
+                msg = line.strip().decode(errors="replace")
+                if not msg:
+                    continue
+                logger.debug(f"REQ[{self.peer}]: {msg}")
+                try:
+                    responses.put(self._route(msg))
+                except ValueError as e:  # e.g. OUT MAYBE
+                    logger.error(e)
+                    responses.put(partial(str, f"error: {e}"))
+        except OSError as e:
+            logger.debug(f"connection from {self.peer} dropped: {e}")
+        finally:
+            for stop in self._stream_stops:
+                stop.set()
+            responses.put(None)
+            writer.join()
+
+    def _readline(self) -> bytes:
+        """Like rfile.readline(), but the connection stays usable after a socket timeout"""
+        while True:
+            end = self._rbuf.find(b"\n")
+            if end >= 0:
+                line = bytes(self._rbuf[:end + 1])
+                del self._rbuf[:end + 1]
+                return line
+            chunk = self.connection.recv(4096)
+            if not chunk:
+                line = bytes(self._rbuf)
+                self._rbuf.clear()
+                return line
+            self._rbuf += chunk
+
+    def _write_responses(self, responses: Queue):
+        while True:
+            pending = responses.get()
+            if pending is None:
+                return
+            try:
+                resp = pending()
+            except Exception as e:  # one bad command shouldn't take the connection down
+                logger.exception(e)
+                resp = f"error: {e}"
+            lines = [resp] if isinstance(resp, str) else resp  # streams yield many lines
+            try:
+                for line in lines:
+                    self.wfile.write((line.rstrip("\n") + "\n").encode())
+            except OSError as e:
+                logger.debug(f"couldn't reply to {self.peer}: {e}")
+            finally:
+                if not isinstance(lines, list):
+                    lines.close()
+
+    def _stream(self, cmd: StreamCommand, stop: threading.Event, streams):
+        """Yield a sample line per tick of cmd.rate, from the shared telemetry poll"""
+        token = streams.subscribe(cmd.rate)
+        try:
+            interval = 1.0 / cmd.rate
+            last = None
+            next_tick = time.monotonic()
+            while not stop.is_set():
+                snapshot = streams.telemetry.latest()
+                if snapshot is not None and snapshot is not last:
+                    last = snapshot
+                    wall_time = time.time() - (time.monotonic() - snapshot.timestamp)
+                    yield cmd.format(snapshot, wall_time)
+                next_tick += interval
+                delay = next_tick - time.monotonic()
+                if delay < 0:
+                    next_tick = time.monotonic()
+                    delay = 0
+                stop.wait(delay)
+        finally:
+            streams.unsubscribe(token)
+
+    def _dispatch_stream(self, item: StreamCommand, channel) -> Callable:
+        if item.stale:
+            return item.result_as_string
+        if item.stop:
+            for stop in self._stream_stops:
+                stop.set()
+            return lambda: "DONE"
+        if channel.streams is None:
+            return lambda: "error: streaming not available"
+        stop = threading.Event()
+        self._stream_stops.append(stop)
+        return partial(self._stream, item, stop, channel.streams)
+
+    def _dispatch_log(self, item, channel) -> Callable:
+        datalog = channel.datalog
+        if datalog is None:
+            return lambda: "error: logging not available"
+        if item.stale:
+            return item.result_as_string
+        if isinstance(item, LogStatusQuery):
+            state = "ON" if datalog.running else "OFF"
+            return partial(str, f"{state},{len(datalog.buffer)},{datalog.rate:.1f}")
+        if item.action == "START":
+            if not datalog.start_queued(channel.serial_q):
+                return lambda: "error: already logging"
+        elif item.action == "STOP":
+            datalog.stop()
+        elif item.action == "EXPORT":
+            name = os.path.basename(item.param)  # no writing outside log_dir
+            if not name:
+                return lambda: "error: LOG EXPORT needs a file name"
+            path = os.path.join(HM305pServer.log_dir, name)
+            datalog.buffer.export(path)
+            logger.info(f"exported {len(datalog.buffer)} samples to {path}")
+            return partial(str, path)
+        return lambda: "DONE"
+
+    def _dispatch_sequence(self, item, channel) -> Callable:
+        sequence = channel.sequence
+        if item.stale:
+            return item.result_as_string
+        if isinstance(item, SequenceStatusQuery):
+            return partial(str, sequence.status())
+        if isinstance(item, SequenceTimesQuery):
+            return lambda: ",".join(f"{t:.4f}" for t in sequence.last_loop_times())
+        if item.action == "STEP":
+            if not sequence.add(Step(*item.step)):
+                return lambda: "error: can't add steps while running, or the sequence is full"
+            return partial(str, len(sequence.steps))
+        elif item.action == "CLEAR":
+            if not sequence.clear():
+                return lambda: "error: sequence running"
+        elif item.action == "RUN":
+            if not sequence.start(channel.serial_q, item.loops):
+                return lambda: "error: sequence running or empty"
+        elif item.action == "STOP":
+            sequence.stop()
+        elif item.action == "EXPORT":
+            name = os.path.basename(item.param)  # no writing outside log_dir
+            if not name:
+                return lambda: "error: SEQ EXPORT needs a file name"
+            path = os.path.join(HM305pServer.log_dir, name)
+            sequence.times.export(path)
+            return partial(str, path)
+        return lambda: "DONE"
+
+    def _dispatch_ramp(self, item, channel) -> Callable:
+        if item.stale:
+            return item.result_as_string
+        ramp = channel.ramps.get(item.setting)
+        if isinstance(item, RampQuery):
+            return partial(str, ramp.status() if ramp is not None else "IDLE")
+        if ramp is not None:
+            ramp.cancel()
+        if not item.stop:
+            ramp = Ramp(getattr(channel.hm, item.setting), item.target, item.rate)
+            channel.ramps[item.setting] = ramp
+            ramp.start(channel.serial_q)
+        return lambda: "DONE"
+
+    @staticmethod
+    def _cancel_ramp(channel, setting: str):
+        """An explicit setpoint wins over a ramp still running on the same setting"""
+        ramp = channel.ramps.get(setting)
+        if ramp is not None:
+            ramp.cancel()
+
+    def _route(self, msg: str) -> Callable[[], str]:
+        """
+        Dispatch msg to the selected channel, or to the ones named by an
+        @name[,name...] or @all prefix. Several channels are queued at once, so they
+        are serviced in parallel, and their responses come back comma separated.
+        """
+        if not msg.startswith("@"):
+            return self._dispatch(msg, self.channel)
+        names, _, msg = msg[1:].partition(" ")
+        channels = self._channels(names)
+        if len(channels) == 1:
+            return self._dispatch(msg, channels[0])
+        return partial(self._gather, [self._dispatch(msg, channel) for channel in channels])
+
+    @staticmethod
+    def _channels(names: str) -> list:
+        names = names.lower()
+        if names == "all":
+            return list(HM305pServer.channels.values())
+        try:
+            return [HM305pServer.channels[name] for name in names.split(",")]
+        except KeyError as e:
+            raise ValueError(f"no channel {e}")
+
+    @staticmethod
+    def _gather(pending: list) -> str:
+        responses = []
+        for wait in pending:
+            resp = wait()
+            if not isinstance(resp, str):
+                resp.close()
+                resp = "error: streams are one channel at a time"
+            responses.append(resp)
+        return ",".join(responses)
+
+    def _dispatch_instrument(self, item) -> Callable:
+        if isinstance(item, InstrumentSelectQuery):
+            return partial(str, self.channel.name)
+        if isinstance(item, InstrumentCatalogQuery):
+            return partial(str, ",".join(HM305pServer.channels))
+        self.channel = self._channels(item.channel)[0]
+        return lambda: "DONE"
+
+    def _dispatch(self, msg: str, channel) -> Callable[[], str]:
+        """Parse and queue msg for channel, returning a function that waits for its response"""
         item = self.command_factory.parse(msg)
         if isinstance(item, SetVoltageCommand):
             logger.debug(f"processing {item} special case")
+            self._cancel_ramp(channel, "voltage")
             setpt = SetVoltageSetpointCommand(item.arg)
-            apply = VoltageApplyCommand()
-            apply.stale |= setpt.stale  # pull this in to handle poorly formatted floats
-            HM305pServer.fast_q.put(setpt)
-            HM305pServer.fast_q.join()
-            HM305pServer.serial_q.put(apply)
-            resp = setpt.result_as_string()
+            channel.fast_q.put(setpt)
+            if self._wait(setpt, channel.fast_q) and not setpt.stale:  # poorly formatted floats stop here
+                self._stage(channel, VoltageApplyCommand())
+            return setpt.result_as_string
         elif isinstance(item, SetCurrentCommand):
             logger.debug(f"processing {item} special case")
+            self._cancel_ramp(channel, "current")
             setpt = SetCurrentSetpointCommand(item.arg)
-            apply = CurrentApplyCommand()
-            apply.stale |= setpt.stale  # pull this in to handle poorly formatted floats
-            HM305pServer.fast_q.put(setpt)
-            HM305pServer.fast_q.join()
-            HM305pServer.serial_q.put(apply)
-            resp = setpt.result_as_string()
+            channel.fast_q.put(setpt)
+            if self._wait(setpt, channel.fast_q) and not setpt.stale:  # poorly formatted floats stop here
+                self._stage(channel, CurrentApplyCommand())
+            return setpt.result_as_string
+        elif isinstance(item, StreamCommand):
+            return self._dispatch_stream(item, channel)
+        elif isinstance(item, (LogCommand, LogStatusQuery)):
+            return self._dispatch_log(item, channel)
+        elif isinstance(
+            item, (InstrumentSelectCommand, InstrumentSelectQuery, InstrumentCatalogQuery)
+        ):
+            return self._dispatch_instrument(item)
+        elif isinstance(item, (SequenceCommand, SequenceStatusQuery, SequenceTimesQuery)):
+            return self._dispatch_sequence(item, channel)
+        elif isinstance(item, (RampCommand, RampQuery)):
+            return self._dispatch_ramp(item, channel)
+        elif isinstance(item, SystemStatsQuery):
+            return lambda: json.dumps(channel.stats(), separators=(",", ":"))
+        elif isinstance(item, BatchCommand) and not all(cmd.batchable for cmd in item.cmds):
+            refused = ", ".join(cmd.__class__.__name__ for cmd in item.cmds if not cmd.batchable)
+            return lambda: f"error: {refused} can't be part of a ;-separated line"
+        elif item is not None and item.answer_from(channel.telemetry):
+            logger.debug(f"answered {item} from telemetry")
+            return item.result_as_string
+        elif item is not None and item.write_register is not None:
+            logger.debug(f"staging {item} write-behind")
+            self._stage(channel, item)
+            return lambda: "DONE"
         elif item is not None:
             if item.uses_serial_port:
                 logger.debug(f"enqueing {item} in the serial queue")
-                q = HM305pServer.serial_q
+                q = channel.serial_q
             else:
                 logger.debug(f"enqueing {item} in the fast queue")
-                q = HM305pServer.fast_q
+                q = channel.fast_q
             q.put(item)
+            if isinstance(item, BatchCommand) and any(cmd.writes for cmd in item.cmds):
+                channel.telemetry.invalidate()
             if item.wait_for_result:
-                logger.debug(f"waiting on {item}")
-                q.join()
-                resp = item.result_as_string()
-                logger.debug(f"{item}")
+                return partial(self._result, item, q)
             else:
-                resp = "DONE\n"
-
+                return lambda: "DONE"
         else:
-            resp = "error: cmd not found"
-        self.wfile.write(resp.encode())
+            return lambda: "error: cmd not found"
+
+    @staticmethod
+    def _stage(channel, item: Command):
+        """Stage item's register write in the channel's WriteBehind instead of queueing it"""
+        channel.writes.write(item.write_register, item.write_value(channel.hm), item.priority)
+        channel.telemetry.invalidate()
+
+    def _result(self, item: Command, queue) -> str:
+        logger.debug(f"waiting on {item}")
+        if not self._wait(item, queue):
+            return "error: timeout"
+        logger.debug(f"{item}")
+        if isinstance(item.result, str) and item.result.startswith("error"):
+            return item.result  # set by the queue handler when invoke() raised
+        if item.result is None:
+            return "error: no response"  # the read timed out or the supply answered with an exception
+        return item.result_as_string()
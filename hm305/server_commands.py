@@ -1,7 +1,10 @@
 import logging
+import threading
+import time
 from functools import partial
 import hm305
 import scpi
+from hm305.scheduler import Priority
 
 logger = logging.getLogger(__name__)
 
@@ -11,9 +14,18 @@ class Command:
         self.stale = False
         self.complete = False
         self.result = None
+        self.deadline = None  # time.monotonic() after which the serial scheduler drops this
+        self.followers = []  # identical reads coalesced into this one by the serial scheduler
+        self._done = threading.Event()
 
     wait_for_result = False
     uses_serial_port = True
+    priority = Priority.INTERACTIVE
+    max_wait = None  # seconds this may sit in the serial queue before it's dropped
+    read_register = None  # set on side-effect free reads so identical ones can share a transaction
+    write_register = None  # set, with a write_value(hm) method, on plain register writes the server stages write-behind
+    writes = False  # True on commands that change the supply's settings, and so its readings
+    batchable = True  # False on commands the server carries out itself, which can't run inside a BatchCommand
 
     def invoke(self, hm: hm305.HM305):
         """
@@ -24,6 +36,30 @@ class Command:
         self.result = "Not implemented"
         self.complete = True
 
+    def finish(self):
+        """
+        Called by the queue handler once it is done with this command, whether it was
+        invoked or dropped as stale. Copies the outcome to any coalesced followers
+        and wakes everything waiting on them.
+        """
+        for follower in self.followers:
+            follower.result = self.result
+            follower.stale = self.stale
+            follower.complete = self.complete
+            follower._done.set()
+        self._done.set()
+
+    def wait(self, timeout=None) -> bool:
+        """Block until a queue handler has finished with this command. False on timeout."""
+        return self._done.wait(timeout)
+
+    def answer_from(self, telemetry) -> bool:
+        """
+        Try to complete the command from a telemetry snapshot instead of the serial port.
+        Returns True if it was answered.
+        """
+        return False
+
     def result_as_string(self):
         return f"{self.result}"
 
@@ -51,6 +87,8 @@ class CommandWithFloatArg(CommandWithArg):
             self.result = "error: bad float"
 
     def result_as_string(self):
+        if isinstance(self.result, str):
+            return self.result
         return f"{self.result:2.3f}"
 
     def __repr__(self):
@@ -64,7 +102,49 @@ class QueryCommand(Command):
         return f"<{self.__class__.__name__}()={self.result}>"
 
 
-class OutputQuery(QueryCommand):
+class SnapshotQuery(QueryCommand):
+    """
+    A query that can be answered from the telemetry snapshot when that is
+    younger than max_age seconds
+    """
+
+    max_age = 1.0
+    snapshot_field = None
+
+    def answer_from(self, telemetry) -> bool:
+        if telemetry is None or self.snapshot_field is None:
+            return False
+        snapshot = telemetry.get(self.max_age)
+        if snapshot is None:
+            return False
+        self.result = getattr(snapshot, self.snapshot_field)
+        self.complete = True
+        return True
+
+
+class TelemetryPollCommand(Command):
+    """Refreshes the telemetry snapshot, queued by the TelemetryPoller"""
+
+    priority = Priority.MONITORING
+    max_wait = 1.0
+
+    def __init__(self, telemetry):
+        super().__init__()
+        self.telemetry = telemetry
+
+    def invoke(self, hm):
+        started = time.monotonic()
+        measurement = hm.measure()
+        status = hm.status() if measurement is not None else None
+        if status is not None:  # a failed read leaves the last good snapshot to age out
+            self.telemetry.update(measurement, status, started)
+        self.complete = True
+
+
+class OutputQuery(SnapshotQuery):
+    snapshot_field = "output"
+    read_register = hm305.HM305.CMD.Output
+
     def invoke(self, hm):
         self.result = hm.output
         self.complete = True
@@ -77,9 +157,17 @@ class SetOutputCommand(CommandWithArg):
     def __init__(self, arg):
         super().__init__(arg)
         self.arg = scpi.decode_on_off(arg)  # ON/OFF->true/false
+        if self.arg:  # switching on must not overtake the setpoints queued before it
+            self.priority = Priority.SETPOINT
 
     uses_serial_port = True
     wait_for_result = False
+    priority = Priority.SAFETY
+    writes = True
+    write_register = hm305.HM305.CMD.Output
+
+    def write_value(self, hm):
+        return int(self.arg)
 
     def invoke(self, hm):
         if self.arg:
@@ -93,21 +181,35 @@ class SetOutputCommand(CommandWithArg):
         return str(self.arg)
 
 
-class MeasureVoltageQuery(QueryCommand):
+class MeasureVoltageQuery(SnapshotQuery):
     uses_serial_port = True
+    snapshot_field = "voltage"
+    read_register = hm305.HM305.CMD.Voltage
 
     def invoke(self, hm):
         self.result = hm.voltage.value
         self.complete = True
 
 
+class MeasurePowerQuery(SnapshotQuery):
+    uses_serial_port = True
+    snapshot_field = "power"
+    read_register = hm305.HM305.CMD.Power
+
+    def invoke(self, hm):
+        self.result = hm.w
+        self.complete = True
+
+
 class SetVoltageCommand(CommandWithFloatArg):
     """
     NOTE: This class is manually split into a SetVoltageSetpoint and a VoltageApply
     Need to find a cleaner way to do this
     """
 
+    writes = True
     uses_serial_port = True
+    priority = Priority.SETPOINT
 
     def invoke(self, hm):
         if not self.complete:
@@ -126,20 +228,19 @@ class SetVoltageSetpointCommand(CommandWithFloatArg):
 
 
 class VoltageApplyCommand(Command):
+    writes = True
     uses_serial_port = True
     wait_for_result = False
-    in_queue = False
+    priority = Priority.SETPOINT
+    write_register = hm305.HM305.CMD.Set_Voltage
 
-    def __init__(self):
+    def __init__(self, arg=None):  # VOLT:APPLY only parses with an argument, which is ignored
         super().__init__()
-        if VoltageApplyCommand.in_queue:  # TODO
-            self.stale = True
-            self.complete = True
-        else:
-            VoltageApplyCommand.in_queue = True
+
+    def write_value(self, hm):
+        return hm.voltage.register_value(hm.voltage.setpoint)
 
     def invoke(self, hm):
-        VoltageApplyCommand.in_queue = False
         hm.voltage.apply()
         self.complete = True
 
@@ -153,16 +254,20 @@ class VoltageSetpointQuery(QueryCommand):
         self.complete = True
 
 
-class MeasureCurrentQuery(QueryCommand):
+class MeasureCurrentQuery(SnapshotQuery):
     uses_serial_port = True
+    snapshot_field = "current"
+    read_register = hm305.HM305.CMD.Current
 
     def invoke(self, hm):
-        self.result = float(hm.current.value)
+        self.result = hm.current.value
         self.complete = True
 
 
 class SetCurrentCommand(CommandWithFloatArg):
+    writes = True
     uses_serial_port = True
+    priority = Priority.SETPOINT
 
     def invoke(self, hm):
         if not self.complete:
@@ -181,20 +286,19 @@ class SetCurrentSetpointCommand(CommandWithFloatArg):
 
 
 class CurrentApplyCommand(Command):
+    writes = True
     uses_serial_port = True
     wait_for_result = False
-    in_queue = False
+    priority = Priority.SETPOINT
+    write_register = hm305.HM305.CMD.Set_Current
 
-    def __init__(self):
+    def __init__(self, arg=None):  # as VoltageApplyCommand
         super().__init__()
-        if CurrentApplyCommand.in_queue:  # TODO
-            self.stale = True
-            self.complete = True
-        else:
-            CurrentApplyCommand.in_queue = True
+
+    def write_value(self, hm):
+        return hm.current.register_value(hm.current.setpoint)
 
     def invoke(self, hm):
-        CurrentApplyCommand.in_queue = False
         hm.current.apply()
         self.complete = True
 
@@ -206,3 +310,339 @@ class CurrentSetpointQuery(QueryCommand):
     def invoke(self, hm):
         self.result = float(hm.current.setpoint)
         self.complete = True
+
+
+class BeepQuery(QueryCommand):
+    read_register = hm305.HM305.CMD.Buzzer
+
+    def invoke(self, hm):
+        self.result = hm.beep
+        self.complete = True
+
+    def result_as_string(self):
+        return scpi.encode_on_off(self.result)
+
+
+class SetBeepCommand(CommandWithArg):
+    writes = True
+    write_register = hm305.HM305.CMD.Buzzer
+
+    def __init__(self, arg):
+        super().__init__(arg)
+        self.arg = scpi.decode_on_off(arg)  # ON/OFF->true/false
+
+    def write_value(self, hm):
+        return int(self.arg)
+
+    def invoke(self, hm):
+        hm.beep = int(self.arg)
+        self.result = self.arg
+        self.complete = True
+
+    def result_as_string(self):
+        return str(self.arg)
+
+
+class StreamCommand(CommandWithArg):
+    """
+    MEASure:STREam <fields> [<rate>HZ] starts pushing timestamped samples down the
+    connection, MEASure:STREam OFF stops it. Handled by the server itself, not a queue.
+    """
+
+    batchable = False
+    FIELDS = {
+        "V": "voltage",
+        "I": "current",
+        "P": "power",
+        "OUT": "output",
+        "PROT": "protect_state",
+    }
+    MAX_RATE = 50.0
+
+    uses_serial_port = False
+
+    def __init__(self, arg):
+        super().__init__(arg)
+        self.fields = []
+        self.rate = 1.0
+        self.stop = arg.upper() in ("OFF", "STOP", "0")
+        if self.stop:
+            return
+        fields, _, rate = arg.upper().partition(" ")
+        try:
+            self.fields = [StreamCommand.FIELDS[f.strip()] for f in fields.split(",")]
+            if rate:
+                self.rate = min(float(rate.strip().rstrip("HZ")), StreamCommand.MAX_RATE)
+            if self.rate <= 0:
+                raise ValueError(rate)
+        except (KeyError, ValueError) as e:
+            self.stale = True
+            logger.error(f"bad stream request {arg}: {e}")
+            self.result = f"error: bad stream request {arg}"
+
+    def format(self, snapshot, wall_time: float) -> str:
+        """One sample: the wall clock time it was read, then the requested fields"""
+        values = [f"{wall_time:.3f}"]
+        for field in self.fields:
+            value = getattr(snapshot, field)
+            if field == "output":
+                values.append(scpi.encode_on_off(value))
+            else:
+                values.append(f"{value}")
+        return ",".join(values)
+
+
+class LogSampleCommand(Command):
+    """One data logger sample, queued back to back by DataLogger.run_queued"""
+
+    priority = Priority.MONITORING
+
+    def __init__(self, datalog):
+        super().__init__()
+        self.datalog = datalog
+
+    def invoke(self, hm):
+        self.datalog.sample(hm)
+        self.complete = True
+
+
+class LogCommand(CommandWithArg):
+    """
+    LOG START [capacity] | LOG STOP | LOG EXPORT <name.csv|name.bin>
+    Handled by the server itself, which owns the data logger.
+    """
+
+    batchable = False
+    ACTIONS = ("START", "STOP", "EXPORT")
+    uses_serial_port = False
+
+    def __init__(self, arg):
+        super().__init__(arg)
+        action, _, self.param = arg.partition(" ")
+        self.action = action.upper()
+        self.param = self.param.strip()
+        if self.action not in LogCommand.ACTIONS:
+            self.stale = True
+            self.result = f"error: LOG {arg}"
+
+
+class LogStatusQuery(QueryCommand):
+    """LOG? -> ON|OFF,<samples stored>,<samples per second>"""
+
+    batchable = False
+    uses_serial_port = False
+
+
+class RampCommand(CommandWithArg):
+    """
+    <setting>:RAMP <target>,<units per second> starts moving the setpoint,
+    <setting>:RAMP OFF stops it where it is.
+    Handled by the server itself, which runs an hm305.ramp.Ramp through the serial queue.
+    """
+
+    batchable = False
+    setting = None  # the HM305 FloatSetting attribute
+    uses_serial_port = False
+
+    def __init__(self, arg):
+        super().__init__(arg)
+        self.stop = arg.strip().upper() in ("OFF", "STOP")
+        self.target = self.rate = None
+        if self.stop:
+            return
+        try:
+            self.target, self.rate = (float(x) for x in arg.split(","))
+        except ValueError:
+            self.rate = 0.0
+        if not self.rate > 0:
+            self.stale = True
+            self.result = f"error: RAMP {arg}"
+
+
+class VoltageRampCommand(RampCommand):
+    setting = "voltage"
+
+
+class CurrentRampCommand(RampCommand):
+    setting = "current"
+
+
+class RampQuery(QueryCommand):
+    """<setting>:RAMP? -> IDLE, or state,setpoint,target,progress,steps,seconds (see Ramp.status)"""
+
+    batchable = False
+    setting = None
+    uses_serial_port = False
+
+
+class VoltageRampQuery(RampQuery):
+    setting = "voltage"
+
+
+class CurrentRampQuery(RampQuery):
+    setting = "current"
+
+
+class WriteBehindFlushCommand(Command):
+    """Writes out whatever an hm305.writebehind.WriteBehind has pending"""
+
+    def __init__(self, writes, priority):
+        super().__init__()
+        self.writes = writes
+        self.priority = priority
+
+    def invoke(self, hm):
+        self.result = self.writes.flush(hm.modbus, self.priority)
+        self.complete = True
+
+
+class RampStepCommand(Command):
+    """One setpoint write of a running hm305.ramp.Ramp"""
+
+    priority = Priority.SETPOINT
+
+    def __init__(self, ramp):
+        super().__init__()
+        self.ramp = ramp
+
+    def invoke(self, hm):
+        self.ramp.step()
+        self.complete = True
+
+
+class SequenceCommand(CommandWithArg):
+    """
+    SEQ STEP <volts>,<amps>,<0|1>,<dwell seconds> | SEQ CLEAR | SEQ RUN [loops, 0 for
+    until stopped] | SEQ STOP | SEQ EXPORT <name.csv|name.bin> (the step timestamps)
+    Handled by the server itself, which owns the channel's hm305.sequence.Sequence.
+    """
+
+    batchable = False
+    ACTIONS = ("STEP", "CLEAR", "RUN", "STOP", "EXPORT")
+    uses_serial_port = False
+
+    def __init__(self, arg):
+        super().__init__(arg)
+        action, _, self.param = arg.partition(" ")
+        self.action = action.upper()
+        self.param = self.param.strip()
+        self.step = None
+        self.loops = 1
+        try:
+            if self.action == "STEP":
+                volts, amps, output, dwell = self.param.split(",")
+                output = {"ON": 1, "OFF": 0}.get(output.strip().upper(), output)
+                self.step = (float(volts), float(amps), int(output), float(dwell))
+                if self.step[2] not in (0, 1) or self.step[3] < 0:
+                    raise ValueError(self.param)
+            elif self.action == "RUN" and self.param:
+                self.loops = int(self.param)
+                if self.loops < 0:
+                    raise ValueError(self.param)
+            elif self.action not in SequenceCommand.ACTIONS:
+                raise ValueError(self.action)
+        except ValueError:
+            self.stale = True
+            self.result = f"error: SEQ {arg}"
+
+
+class SequenceStatusQuery(QueryCommand):
+    """SEQ? -> state,loop,step,steps,worst lateness ms (see Sequence.status)"""
+
+    batchable = False
+    uses_serial_port = False
+
+
+class SequenceTimesQuery(QueryCommand):
+    """SEQ:TIMes? -> when each step of the latest loop actually took effect, seconds from the start"""
+
+    batchable = False
+    uses_serial_port = False
+
+
+class SequenceStepCommand(Command):
+    """Applies one step of a running hm305.sequence.Sequence"""
+
+    priority = Priority.SETPOINT
+
+    def __init__(self, sequence, step):
+        super().__init__()
+        self.sequence = sequence
+        self.step = step
+        self.applied = None  # time.monotonic() once the supply has the step's settings
+
+    def invoke(self, hm):
+        self.applied = self.sequence.apply(hm, self.step)
+        self.complete = True
+
+
+class SystemStatsQuery(QueryCommand):
+    """
+    SYST:STAT? -> the channel's runtime metrics as one line of JSON:
+    Modbus latency and error counts, queue depth and wait, stale drops
+    """
+
+    batchable = False
+    uses_serial_port = False
+
+
+class InstrumentSelectCommand(CommandWithArg):
+    """
+    INST:SEL <channel>, picks the supply the rest of this connection talks to.
+    Handled by the server itself, which owns the channels.
+    """
+
+    batchable = False
+    uses_serial_port = False
+
+    def __init__(self, arg):
+        super().__init__(arg)
+        self.channel = arg.strip().lower()
+
+
+class InstrumentSelectQuery(QueryCommand):
+    """INST:SEL? -> the channel this connection talks to"""
+
+    batchable = False
+    uses_serial_port = False
+
+
+class InstrumentCatalogQuery(QueryCommand):
+    """INST:CAT? -> every channel this server serves, comma separated"""
+
+    batchable = False
+    uses_serial_port = False
+
+
+class BatchCommand(Command):
+    """
+    Several commands from one ;-separated line, run back to back in a single
+    serial queue slot. Query results come back together, ;-separated.
+    """
+
+    wait_for_result = True
+
+    def __init__(self, cmds):
+        super().__init__()
+        self.cmds = cmds
+        self.uses_serial_port = any(cmd.uses_serial_port for cmd in cmds)
+        self.priority = min(cmd.priority for cmd in cmds)
+
+    def invoke(self, hm):
+        for cmd in self.cmds:
+            if not cmd.stale:
+                cmd.invoke(hm)
+        self.result = [
+            cmd.result_as_string()
+            for cmd in self.cmds
+            if cmd.wait_for_result or cmd.stale
+        ]
+        self.complete = True
+
+    def result_as_string(self):
+        if not self.result:
+            return "DONE"
+        return ";".join(self.result)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}{self.cmds}>"
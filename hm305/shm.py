@@ -0,0 +1,87 @@
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+
+Sample = namedtuple(
+    "Sample", "wall_time voltage current power output protect_state"
+)
+
+
+class _Segment:
+    """
+    Layout of the memory-mapped telemetry file:
+    a sequence counter, then one Sample. The counter is odd while the writer
+    is mid-update (a seqlock), so readers retry instead of seeing a torn sample.
+    """
+
+    DEFAULT_PATH = "/dev/shm/hm305.tlm"
+    SEQ = struct.Struct("<Q")
+    SAMPLE = struct.Struct("<ddddii")
+    SIZE = SEQ.size + SAMPLE.size
+
+
+class ShmPublisher(_Segment):
+    """Writes the latest telemetry into the segment, for local readers"""
+
+    def __init__(self, path=_Segment.DEFAULT_PATH):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.SIZE)
+            self._map = mmap.mmap(fd, self.SIZE)
+        finally:
+            os.close(fd)
+        self._seq = self.SEQ.unpack_from(self._map, 0)[0] & ~1
+
+    def publish(self, snapshot):
+        """Telemetry listener: copy a telemetry.Snapshot into the segment"""
+        wall_time = time.time() - (time.monotonic() - snapshot.timestamp)
+        self._seq += 1
+        self.SEQ.pack_into(self._map, 0, self._seq)  # odd: update in progress
+        self.SAMPLE.pack_into(
+            self._map,
+            self.SEQ.size,
+            wall_time,
+            snapshot.voltage,
+            snapshot.current,
+            snapshot.power,
+            snapshot.output,
+            snapshot.protect_state,
+        )
+        self._seq += 1
+        self.SEQ.pack_into(self._map, 0, self._seq)
+
+    def close(self):
+        self._map.close()
+
+
+class ShmReader(_Segment):
+    """Reads the latest telemetry from the segment without talking to the server"""
+
+    def __init__(self, path=_Segment.DEFAULT_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), self.SIZE, access=mmap.ACCESS_READ)
+
+    def read(self, retries=1000):
+        """The latest Sample, or None if nothing has been published yet"""
+        seq, sample = self.SEQ, self.SAMPLE
+        for _ in range(retries):
+            before = seq.unpack_from(self._map, 0)[0]
+            if before & 1:
+                continue
+            values = sample.unpack_from(self._map, seq.size)
+            if seq.unpack_from(self._map, 0)[0] == before:
+                return None if before == 0 else Sample(*values)
+        raise TimeoutError(f"{self.path} never settled")
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
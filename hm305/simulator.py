@@ -0,0 +1,445 @@
+"""
+A simulated HM305 for running the rest of the repo without a supply attached.
+
+SimulatedHM305 is the device: the register map from HM305.CMD and HM305.PRESET behind
+Modbus RTU framing, CRC checks and exception responses. Two transports put it on a link:
+SimulatedSerial is a file-like object that can be handed straight to Modbus(fd) or
+HM305(fd), and SimulatedPty serves it on a pseudo terminal that hm305p_server.py
+--serial-port or hm305.py --port can open. Both can model the time the link takes
+(baud rate, turnaround) and inject faults (corrupted CRCs, dropped bytes).
+
+    python3 -m hm305.simulator --baud 9600 --turnaround 0.01
+"""
+import argparse
+import collections
+import logging
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+from typing import Optional
+
+from hm305 import HM305
+from modbus import Modbus
+
+logger = logging.getLogger(__name__)
+
+
+class _Refused(Exception):
+    """Raised while handling a request to answer with a Modbus exception frame"""
+
+    def __init__(self, code: int):
+        super().__init__(code)
+        self.code = code
+
+
+def _factory_presets() -> dict:
+    """M1 - M6 as they leave the factory, see HM305.PRESET"""
+    registers = {}
+    for n, key in enumerate(HM305.PRESET.Memory.values()):
+        registers[key["Volts"]] = (320, 960, 1600, 2240, 2880, 3200)[n]
+        registers[key["Amps"]] = (1010, 3030, 5050, 7070, 9090, 10100)[n]
+        registers[key["Time_span"]] = 10 + n
+        registers[key["Enabled"]] = 1
+    return registers
+
+
+class SimulatedHM305:
+    """
+    Register-level model of the supply. The output follows the setpoints into a
+    resistive load: constant voltage until the load would draw more than the current
+    setpoint, constant current after that.
+    """
+
+    IllegalFunction = 0x01
+    IllegalDataAddress = 0x02
+    IllegalDataValue = 0x03
+    CRCError = 0x08  # the HM305 answers a corrupted request with this, see Modbus.RxPacket
+    MaxReadCount = 125
+
+    CMD = HM305.CMD
+    READ_ONLY = {
+        CMD.ProtectionStatus: 0,
+        CMD.ModelNum: 3005,
+        CMD.Class_detail: 0x4B50,  # "KP"
+        CMD.Decimals: 0x233,
+        CMD.Voltage: 0,
+        CMD.Current: 0,
+        CMD.Power: 0,
+        CMD.Power + 1: 0,
+        CMD.Device: 0,
+        CMD.SD_Time: 0,
+        CMD.Voltage_Min: 10,
+        CMD.Voltage_Max: 3200,
+        CMD.Voltage_Max + 1: 0,  # HM305.vmax reads a word
+        CMD.Current_Min: 21,
+        CMD.Current_Max: 10100,
+        CMD.Current_Max + 1: 0,  # HM305.cmax reads a word
+    }
+    WRITABLE = {
+        CMD.Output: 0,
+        CMD.Power_cal: 0,
+        CMD.Power_cal + 1: 0,
+        CMD.Protect_Voltage: 3300,
+        CMD.Protect_Current: 10200,
+        CMD.Protect_Power: 0,
+        CMD.Protect_Power + 1: 32000,
+        CMD.Set_Voltage: 500,
+        CMD.Set_Current: 1000,
+        CMD.Set_Time_span: 0,
+        CMD.Power_state: 0,
+        CMD.Default_show: 0,
+        CMD.SCP: 0,
+        CMD.Buzzer: 1,
+    }
+    WRITABLE.update(_factory_presets())
+
+    def __init__(self, address: int = 1, load: float = 10.0):
+        """
+        :param address: the Modbus device address to answer to
+        :param load: resistance across the output, in ohms
+        """
+        self.address = address
+        self.load = load
+        self.registers = dict(self.READ_ONLY)
+        self.registers.update(self.WRITABLE)
+        self.transactions = 0
+        self._lock = threading.Lock()
+
+    def handle(self, frame: bytes) -> Optional[bytes]:
+        """The response to one request frame, or None if the device stays silent"""
+        if len(frame) < 4 or frame[0] != self.address:
+            return None
+        function_code = frame[1]
+        with self._lock:
+            self.transactions += 1
+            try:
+                if Modbus.calculate_crc(frame[:-2]) != struct.unpack("<H", frame[-2:])[0]:
+                    raise _Refused(self.CRCError)
+                if function_code == Modbus.ReadMultichannelRegisterInput:
+                    pdu = self._read(*struct.unpack(">HH", frame[2:6]))
+                elif function_code == Modbus.WriteSingleRegister:
+                    address, value = struct.unpack(">HH", frame[2:6])
+                    self._write(address, (value,))
+                    pdu = frame[2:6]
+                elif function_code == Modbus.WriteMultipleRegisters:
+                    address, count, length = struct.unpack(">HHB", frame[2:7])
+                    if length != 2 * count or len(frame) != 9 + length:
+                        raise _Refused(self.IllegalDataValue)
+                    self._write(address, struct.unpack(f">{count}H", frame[7:-2]))
+                    pdu = frame[2:6]
+                else:
+                    raise _Refused(self.IllegalFunction)
+            except _Refused as e:
+                function_code |= 0x80
+                pdu = bytes((e.code,))
+        resp = bytes((self.address, function_code)) + pdu
+        return resp + struct.pack("<H", Modbus.calculate_crc(resp))
+
+    def _read(self, address: int, count: int) -> bytes:
+        if not 1 <= count <= self.MaxReadCount:
+            raise _Refused(self.IllegalDataValue)
+        addresses = range(address, address + count)
+        if any(a not in self.registers for a in addresses):
+            raise _Refused(self.IllegalDataAddress)
+        self._update_outputs()
+        words = [self.registers[a] for a in addresses]
+        return struct.pack(f">B{count}H", 2 * count, *words)
+
+    def _write(self, address: int, values):
+        """All of values or none of them, like the real thing"""
+        addresses = range(address, address + len(values))
+        if any(a not in self.WRITABLE for a in addresses):
+            raise _Refused(self.IllegalDataAddress)
+        limits = {
+            self.CMD.Output: 1,
+            self.CMD.Set_Voltage: self.registers[self.CMD.Voltage_Max],
+            self.CMD.Set_Current: self.registers[self.CMD.Current_Max],
+        }
+        if any(value > limits.get(a, 0xFFFF) for a, value in zip(addresses, values)):
+            raise _Refused(self.IllegalDataValue)
+        self.registers.update(zip(addresses, values))
+
+    def _update_outputs(self):
+        regs, cmd = self.registers, self.CMD
+        volts = amps = 0.0
+        if regs[cmd.Output]:
+            volts = regs[cmd.Set_Voltage] / 100
+            amps_limit = regs[cmd.Set_Current] / 1000
+            amps = volts / self.load if self.load > 0 else amps_limit
+            if amps > amps_limit:  # constant current
+                amps = amps_limit
+                volts = amps * self.load
+        milliwatts = int(round(volts * amps * 1000))
+        regs[cmd.Voltage] = int(round(volts * 100))
+        regs[cmd.Current] = int(round(amps * 1000))
+        regs[cmd.Power] = milliwatts >> 16
+        regs[cmd.Power + 1] = milliwatts & 0xFFFF
+
+
+def request_length(header: bytes) -> Optional[int]:
+    """
+    Total length of a request frame (including CRC) from its first 7 bytes,
+    or None if the function code is unknown
+    """
+    function_code = header[1]
+    if function_code == Modbus.WriteMultipleRegisters:  # addr, fn, reg, count, length, data, crc
+        return 9 + header[6]
+    if function_code in (Modbus.ReadMultichannelRegisterInput, Modbus.WriteSingleRegister):
+        return 8
+    return None
+
+
+class _Link:
+    """Timing and fault injection shared by the transports"""
+
+    def __init__(
+        self,
+        device: Optional[SimulatedHM305] = None,
+        baudrate: Optional[float] = 9600,
+        turnaround: float = 0.0,
+        crc_error_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed=None,
+    ):
+        """
+        :param device: the simulated supply, a fresh SimulatedHM305 by default
+        :param baudrate: link speed for 8N1 character timing, None for no transfer time
+        :param turnaround: seconds the device takes between a request and its response
+        :param crc_error_rate: fraction of responses sent with a corrupted CRC
+        :param drop_rate: fraction of responses sent with one byte missing
+        :param seed: for a repeatable fault sequence
+        """
+        self.device = device if device is not None else SimulatedHM305()
+        self.char_time = 10.0 / baudrate if baudrate else 0.0
+        self.turnaround = turnaround
+        self.crc_error_rate = crc_error_rate
+        self.drop_rate = drop_rate
+        self.faults = collections.Counter()
+        self._random = random.Random(seed)
+        self._rxbuf = bytearray()
+
+    def _requests(self, data: bytes):
+        """Split the bytes written to the device into request frames"""
+        buf = self._rxbuf
+        buf += data
+        while len(buf) >= 8:
+            length = request_length(buf[:7])
+            if length is None:
+                length = len(buf)  # garbage, let the device refuse all of it
+            if len(buf) < length:
+                break
+            yield bytes(buf[:length])
+            del buf[:length]
+
+    def _respond(self, request: bytes) -> bytes:
+        """The bytes that make it back over the link for request, faults included"""
+        resp = self.device.handle(request)
+        if resp is None:
+            return b""
+        if self._random.random() < self.crc_error_rate:
+            self.faults["crc"] += 1
+            resp = resp[:-1] + bytes((resp[-1] ^ 0xFF,))
+        if self._random.random() < self.drop_rate:
+            self.faults["drop"] += 1
+            i = self._random.randrange(len(resp))
+            resp = resp[:i] + resp[i + 1:]
+        return resp
+
+
+class SimulatedSerial(_Link):
+    """
+    File-like stand-in for serial.Serial, wired to a SimulatedHM305:
+    HM305(SimulatedSerial(baudrate=None)) runs the driver with no hardware and no delays.
+    Response bytes become readable at the time they would arrive over the link.
+    """
+
+    def __init__(self, device: Optional[SimulatedHM305] = None, timeout: Optional[float] = 0.1, **link):
+        """
+        :param timeout: read timeout in seconds, as for serial.Serial
+        :param link: see _Link
+        """
+        super().__init__(device, **link)
+        self.timeout = timeout
+        self._segments = collections.deque()  # [arrival time of the first byte, bytearray]
+        self._line_free = 0.0
+        self.is_open = True
+
+    def write(self, data: bytes) -> int:
+        now = time.monotonic()
+        start = max(now, self._line_free)
+        for request in self._requests(data):
+            start += len(request) * self.char_time + self.turnaround
+            resp = self._respond(request)
+            if resp:
+                self._segments.append([start + self.char_time, bytearray(resp)])
+                start += len(resp) * self.char_time
+        self._line_free = start
+        return len(data)
+
+    def _arrived(self, now: float) -> int:
+        """How many response bytes have arrived by now"""
+        count = 0
+        for first, data in self._segments:
+            if first > now:
+                break
+            if self.char_time:
+                n = min(len(data), int((now - first) / self.char_time) + 1)
+            else:
+                n = len(data)
+            count += n
+            if n < len(data):
+                break
+        return count
+
+    def _arrival_of(self, n: int) -> Optional[float]:
+        """When the nth response byte arrives, None if it was never sent"""
+        for first, data in self._segments:
+            if n <= len(data):
+                return first + (n - 1) * self.char_time
+            n -= len(data)
+        return None
+
+    def _take(self, count: int) -> bytes:
+        out = bytearray()
+        while count and self._segments:
+            segment = self._segments[0]
+            first, data = segment
+            chunk = data[:count]
+            del data[:count]
+            out += chunk
+            count -= len(chunk)
+            if data:
+                segment[0] = first + len(chunk) * self.char_time
+            else:
+                self._segments.popleft()
+        return bytes(out)
+
+    def read(self, size: int = 1) -> bytes:
+        now = time.monotonic()
+        deadline = None if self.timeout is None else now + self.timeout
+        ready = self._arrival_of(size)
+        if ready is None:  # never coming, wait out the timeout for whatever does
+            ready = deadline if deadline is not None else self._arrival_of(self.in_flight)
+        elif deadline is not None:
+            ready = min(ready, deadline)
+        if ready is not None and ready > now:
+            time.sleep(ready - now)
+            now = ready
+        return self._take(min(size, self._arrived(now)))
+
+    @property
+    def in_flight(self) -> int:
+        """Response bytes sent but not read yet, arrived or not"""
+        return sum(len(data) for _, data in self._segments)
+
+    @property
+    def in_waiting(self) -> int:
+        return self._arrived(time.monotonic())
+
+    def reset_input_buffer(self):
+        self._take(self._arrived(time.monotonic()))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SimulatedPty(_Link):
+    """
+    Serves a SimulatedHM305 on a pseudo terminal, for anything that opens a serial port
+    by path. Each response is held back for the time the request and response would
+    take on the modelled link.
+    """
+
+    def __init__(self, device: Optional[SimulatedHM305] = None, **link):
+        """:param link: see _Link"""
+        super().__init__(device, **link)
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._closed = threading.Event()
+
+    def start(self) -> "SimulatedPty":
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def run(self):
+        while not self._closed.is_set():
+            try:
+                readable, _, _ = select.select([self._master], [], [], 0.1)
+            except (OSError, ValueError):  # closed under us
+                return
+            if not readable:
+                self._rxbuf.clear()  # the line went quiet, resync on the next frame
+                continue
+            try:
+                data = os.read(self._master, 256)
+            except OSError:
+                return
+            for request in self._requests(data):
+                resp = self._respond(request)
+                delay = (len(request) + len(resp)) * self.char_time + self.turnaround
+                if delay:
+                    time.sleep(delay)
+                if resp:
+                    os.write(self._master, resp)
+
+    def close(self):
+        self._closed.set()
+        os.close(self._slave)
+        os.close(self._master)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve a simulated HM305 on a pty")
+    parser.add_argument("--address", type=int, default=1, help="Modbus device address")
+    parser.add_argument("--load", type=float, default=10.0, help="load resistance in ohms")
+    parser.add_argument("--baud", type=float, default=9600, help="modelled baud rate, 0 for no transfer time")
+    parser.add_argument("--turnaround", type=float, default=0.0, help="device response delay in seconds")
+    parser.add_argument("--crc-error-rate", type=float, default=0.0, help="fraction of responses with a bad CRC")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of responses missing a byte")
+    parser.add_argument("--seed", type=int, help="seed for the fault injection")
+    args = parser.parse_args()
+
+    sim = SimulatedPty(
+        SimulatedHM305(args.address, args.load),
+        baudrate=args.baud,
+        turnaround=args.turnaround,
+        crc_error_rate=args.crc_error_rate,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    )
+    print(sim.port, flush=True)
+    try:
+        sim.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.close()
+        if sim.faults:
+            print(f"injected faults: {dict(sim.faults)}")
+
+
+if __name__ == "__main__":
+    main()
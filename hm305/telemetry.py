@@ -0,0 +1,155 @@
+import itertools
+import logging
+import threading
+import time
+from collections import namedtuple
+from typing import Optional
+
+from hm305.server_commands import TelemetryPollCommand
+
+logger = logging.getLogger(__name__)
+
+Snapshot = namedtuple(
+    "Snapshot", "timestamp voltage current power output protect_state"
+)
+
+
+class Telemetry:
+    """
+    The most recent readings from the supply, stamped with time.monotonic().
+    invalidate() keeps get() from serving readings taken before a write that changes
+    them, until a poll started after it comes in.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Snapshot] = None
+        self._read_started = None  # time.monotonic() the reads behind _snapshot began
+        self._invalidated = None
+        self.listeners = []  # called with each new Snapshot, from the serial worker thread
+
+    def update(self, measurement, status, read_started: float = None):
+        """
+        :param read_started: time.monotonic() before the readings were taken,
+        defaults to now
+        """
+        snapshot = Snapshot(
+            time.monotonic(),
+            measurement.voltage,
+            measurement.current,
+            measurement.power,
+            status.output,
+            status.protect_state,
+        )
+        with self._lock:
+            self._snapshot = snapshot
+            self._read_started = snapshot.timestamp if read_started is None else read_started
+        for listener in self.listeners:
+            listener(snapshot)
+
+    def latest(self) -> Optional[Snapshot]:
+        with self._lock:
+            return self._snapshot
+
+    def get(self, max_age: float) -> Optional[Snapshot]:
+        """The latest snapshot if it is younger than max_age seconds, else None"""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or (self._invalidated is not None and self._read_started <= self._invalidated):
+                return None
+        if time.monotonic() - snapshot.timestamp > max_age:
+            return None
+        return snapshot
+
+    def invalidate(self):
+        """A write that changes the readings is queued: get() waits for a poll started after it"""
+        with self._lock:
+            self._invalidated = time.monotonic()
+
+
+class TelemetryPoller:
+    """
+    Periodically puts a TelemetryPollCommand in the serial queue so the serial
+    worker stays the only thing touching the port. Never has more than one poll queued.
+    A rate of 0 leaves it idle until the rate is raised.
+    """
+
+    time_to_die = False
+
+    def __init__(self, queue, telemetry: Telemetry, rate: float):
+        """
+        :param queue: the serial queue
+        :param telemetry: where the poll results go
+        :param rate: polls per second
+        """
+        self.queue = queue
+        self.telemetry = telemetry
+        self._rate = rate
+        self._rate_changed = threading.Event()
+        self._pending: Optional[TelemetryPollCommand] = None
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: float):
+        self._rate = rate
+        self._rate_changed.set()
+
+    def run(self):
+        next_poll = time.monotonic()
+        while not self.time_to_die:
+            rate = self._rate
+            if rate <= 0:
+                self._rate_changed.wait(1)
+                self._rate_changed.clear()
+                next_poll = time.monotonic()
+                continue
+            pending = self._pending
+            if pending is None or pending.complete or pending.stale:
+                self._pending = TelemetryPollCommand(self.telemetry)
+                self.queue.put(self._pending)
+            else:
+                logger.debug("previous telemetry poll still queued, skipping")
+            next_poll += 1.0 / rate
+            delay = next_poll - time.monotonic()
+            if delay > 0:
+                if self._rate_changed.wait(delay):
+                    self._rate_changed.clear()
+                    next_poll = time.monotonic()
+            else:
+                next_poll = time.monotonic()  # fell behind, don't try to catch up
+
+
+class StreamHub:
+    """
+    Lets any number of streaming subscribers share one TelemetryPoller,
+    which runs at the fastest rate anybody currently wants
+    """
+
+    def __init__(self, poller: TelemetryPoller):
+        self.poller = poller
+        self.telemetry = poller.telemetry
+        self._base_rate = poller.rate
+        self._lock = threading.Lock()
+        self._rates = {}
+        self._ids = itertools.count()
+
+    def subscribe(self, rate: float) -> int:
+        with self._lock:
+            token = next(self._ids)
+            self._rates[token] = rate
+            self._update_rate()
+        return token
+
+    def unsubscribe(self, token: int):
+        with self._lock:
+            self._rates.pop(token, None)
+            self._update_rate()
+
+    def _update_rate(self):
+        rate = max([self._base_rate, *self._rates.values()])
+        if rate != self.poller.rate:
+            logger.debug(f"telemetry poll rate now {rate} Hz")
+            self.poller.rate = rate
@@ -0,0 +1,147 @@
+import itertools
+import logging
+import threading
+
+from hm305.server_commands import WriteBehindFlushCommand
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehind:
+    """
+    Staged register writes for one supply. write() only records the latest value for
+    a register and makes sure a WriteBehindFlushCommand is queued at its priority; the
+    serial worker then writes whatever is pending when it gets there. However many
+    times a register is written before that, it costs one transaction.
+    Writes go out in the order registers were first staged, a new value taking the
+    place of the one it replaces, except that a more urgent priority (output off)
+    goes first. Registers next to each other in that order share a single 0x10
+    write. A write the supply doesn't acknowledge is staged again, unless a newer
+    value has been, up to retries times.
+    """
+
+    retries = 3
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.staged = 0
+        self.overwritten = 0  # writes replaced by a newer one before they reached the supply
+        self.flushes = 0
+        self.transactions = 0
+        self.failed = 0
+        self._pending = {}  # register -> (priority, staging sequence number, value, failed attempts)
+        self._queued = set()  # priorities with a flush waiting in the queue
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def write(self, register: int, value: int, priority):
+        """Stage value for register, to be written at priority"""
+        with self._lock:
+            self.staged += 1
+            previous = self._pending.get(register)
+            if previous is not None:
+                self.overwritten += 1
+            if previous is not None and previous[0] == priority:
+                seq = previous[1]  # keeps its place: whatever was staged after it still goes out after it
+            else:
+                seq = next(self._seq)
+            self._pending[register] = (priority, seq, value, 0)
+        self._queue_flush(priority)
+
+    def _queue_flush(self, priority):
+        with self._lock:
+            if priority in self._queued:
+                return
+            self._queued.add(priority)
+        self.queue.put(WriteBehindFlushCommand(self, priority))
+
+    def pending(self) -> dict:
+        """register -> value of everything not yet written"""
+        with self._lock:
+            return {register: value for register, (_, _, value, _) in self._pending.items()}
+
+    def flush(self, modbus, priority) -> int:
+        """
+        Called on the serial worker: write out everything pending at priority or a
+        more urgent one. Returns the transactions used.
+        """
+        with self._lock:
+            self._queued.discard(priority)
+            due = sorted(
+                (p, seq, register, value, attempts)
+                for register, (p, seq, value, attempts) in self._pending.items()
+                if p <= priority
+            )
+            for _, _, register, _, _ in due:
+                del self._pending[register]
+        if not due:
+            return 0
+        runs = []  # [priority, first register, values, [(sequence number, attempts) per value]]
+        for p, seq, register, value, attempts in due:
+            run = runs[-1] if runs else None
+            if run is not None and run[0] == p and register == run[1] + len(run[2]):
+                run[2].append(value)
+                run[3].append((seq, attempts))
+            elif run is not None and run[0] == p and register == run[1] - 1:
+                run[1] = register
+                run[2].insert(0, value)
+                run[3].insert(0, (seq, attempts))
+            else:
+                runs.append([p, register, [value], [(seq, attempts)]])
+        written = 0
+        for p, register, values, staged in runs:
+            written += 1
+            try:
+                if len(values) == 1:
+                    ok = modbus.set_by_addr(register, values[0])
+                else:
+                    ok = modbus.write_registers(register, values)
+            except Exception as e:
+                ok = False
+                logger.error(f"write-behind {register:#06x} {values}: {e}")
+            else:
+                if not ok:
+                    logger.warning(f"write-behind {register:#06x} {values} not acknowledged")
+            if not ok:
+                # the rest waits for the retry, so nothing staged after this goes out before it
+                self.failed += 1
+                self._restage(runs[written - 1:])
+                break
+        self.flushes += 1
+        self.transactions += written
+        return written
+
+    def _restage(self, runs: list):
+        """
+        Stage runs from a flush again, the first of them having failed, keeping their
+        place in the staging order. A register staged anew since keeps its new value,
+        in the old one's place.
+        """
+        priorities = set()
+        with self._lock:
+            for i, (p, first, values, staged) in enumerate(runs):
+                for offset, (value, (seq, attempts)) in enumerate(zip(values, staged)):
+                    register = first + offset
+                    newer = self._pending.get(register)
+                    if newer is not None:
+                        if newer[0] == p:
+                            self._pending[register] = (p, seq, newer[2], newer[3])
+                        continue
+                    if i == 0:
+                        attempts += 1
+                        if attempts >= self.retries:
+                            logger.error(f"write-behind {register:#06x}={value} gave up after {attempts} attempts")
+                            continue
+                    self._pending[register] = (p, seq, value, attempts)
+                    priorities.add(p)
+        for p in priorities:
+            self._queue_flush(p)
+
+    def stats(self) -> dict:
+        return {
+            "staged": self.staged,
+            "overwritten": self.overwritten,
+            "flushes": self.flushes,
+            "transactions": self.transactions,
+            "failed": self.failed,
+        }
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
+import os
 import socket
+from contextlib import ExitStack
 from time import sleep
 
 import hm305
@@ -7,11 +9,16 @@ import sys
 import serial
 import logging
 import socketserver
-from queue import Queue
 import threading
 
+from hm305.channel import Channel
+from hm305.client import DaemonClient
+from hm305.metrics import serve_metrics
 from hm305.queue_handler import HM305pSerialQueueHandler, HM305pFastQueueHandler
-from hm305.server import HM305pServer
+from hm305.server import HM305pServer, BoundedThreadingMixIn
+from hm305.server_commands import SnapshotQuery
+from hm305.shm import ShmPublisher
+from hm305.telemetry import TelemetryPoller
 
 logging.basicConfig(format='%(msecs)03d/%(name)s: %(message)s', level=logging.DEBUG)
 
@@ -22,6 +29,7 @@ def exit_gracefully(a=None, b=None):
     global server
     HM305pSerialQueueHandler.time_to_die = True
     HM305pFastQueueHandler.time_to_die = True
+    TelemetryPoller.time_to_die = True
     server.shutdown()
     server.socket.close()
     exit(0)
@@ -30,21 +38,53 @@ def exit_gracefully(a=None, b=None):
 # psu0 on : snmpset -v 1 -c private pdu 1.3.6.1.4.1.318.1.1.4.4.2.1.3.8 i 1
 # psu1 on : snmpset -v 1 -c private pdu 1.3.6.1.4.1.318.1.1.4.4.2.1.3.7 i 1
 
-class ReusableServer(socketserver.TCPServer):
+class ReusableServer(BoundedThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
     # server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
 
+class LocalServer(BoundedThreadingMixIn, socketserver.UnixStreamServer):
+    """Same protocol as the TCP server, for `hm305.py --via-daemon` on this machine"""
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)  # left over from a previous run
+        super().server_bind()
+
+
 def main():
     import argparse
     global server
     print(sys.argv)
     parser = argparse.ArgumentParser()
     parser.add_argument('name_tag', nargs='?', default="none")
-    parser.add_argument('--serial-port', type=str, help='serial port', required=True)
+    parser.add_argument('--serial-port', type=str, action='append', metavar='[NAME=]PORT', required=True,
+                        help='serial port, repeat to serve several supplies as named channels '
+                             '(INST:SEL NAME or an @NAME prefix), the first one is selected on connect')
     parser.add_argument('--port', type=int, help='network port', required=True)
     parser.add_argument('--addr', type=str, help='ip to bind to', required=False, default='0.0.0.0')
+    parser.add_argument('--unix-socket', type=str, metavar='PATH', nargs='?', const=DaemonClient.DEFAULT_SOCKET,
+                        help='also listen on a unix domain socket, for hm305.py --via-daemon '
+                             f'(default {DaemonClient.DEFAULT_SOCKET})')
     parser.add_argument('--debug', action='store_true', help='enable verbose logging')
+    parser.add_argument('--idle-timeout', type=float, default=HM305pServer.timeout,
+                        help='close client connections after this many idle seconds')
+    parser.add_argument('--max-clients', type=int, default=ReusableServer.max_clients,
+                        help='number of client connections served at once')
+    parser.add_argument('--log-capacity', type=int, default=1_000_000,
+                        help='samples kept by the LOG START data logger')
+    parser.add_argument('--log-dir', type=str, default=HM305pServer.log_dir,
+                        help='directory LOG EXPORT writes to')
+    parser.add_argument('--shm', type=str, metavar='PATH', nargs='?', const=ShmPublisher.DEFAULT_PATH,
+                        help='publish each telemetry snapshot to a memory-mapped file for hm305.py --from-shm '
+                             f'(default {ShmPublisher.DEFAULT_PATH}, with .NAME appended per channel '
+                             'when there are several)')
+    parser.add_argument('--poll-rate', type=float, default=0.0,
+                        help='refresh a telemetry snapshot this many times a second (0 = off)')
+    parser.add_argument('--max-age', type=float, default=SnapshotQuery.max_age,
+                        help='answer measurement queries from a snapshot younger than this many seconds')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus metrics over HTTP on this port (SYST:STAT? works regardless)')
     args = parser.parse_args()
 
     if len(sys.argv) == 1:
@@ -52,22 +92,45 @@ def main():
         parser.print_help()
         sys.exit(1)
 
-    HM305pServer.serial_q = Queue()
-    HM305pServer.fast_q = Queue()
+    HM305pServer.timeout = args.idle_timeout
+    HM305pServer.log_dir = args.log_dir
+    ReusableServer.max_clients = args.max_clients
+    SnapshotQuery.max_age = args.max_age
 
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
-    with serial.Serial(args.serial_port, baudrate=9600, timeout=0.1) as ser:
-        # ser.set_low_latency_mode(True) # doesn't work on ch341
-        hm = hm305.HM305(ser)
-        serial_consumer = HM305pSerialQueueHandler(HM305pServer.serial_q, hm)
-        serial_consumer_thread = threading.Thread(target=serial_consumer.run)
-        serial_consumer_thread.daemon = True
-        serial_consumer_thread.start()
-        fast_consumer = HM305pFastQueueHandler(HM305pServer.fast_q, hm)
-        fast_consumer_thread = threading.Thread(target=fast_consumer.run)
-        fast_consumer_thread.daemon = True
-        fast_consumer_thread.start()
+    if args.shm and args.poll_rate <= 0:
+        args.poll_rate = 1.0
+        logging.info(f"--shm needs the poller running, polling at {args.poll_rate} Hz")
+
+    ports = {}
+    for i, spec in enumerate(args.serial_port):
+        name, sep, path = spec.partition('=')
+        if not sep:
+            name, path = (args.name_tag if len(args.serial_port) == 1 else f"ch{i}"), spec
+        ports[name.lower()] = path
+    if len(ports) != len(args.serial_port) or 'all' in ports:
+        parser.error('channel names must be unique, and not "all"')
+
+    with ExitStack() as stack:
+        for name, path in ports.items():
+            ser = stack.enter_context(serial.Serial(path, baudrate=9600, timeout=0.1))
+            # ser.set_low_latency_mode(True) # doesn't work on ch341
+            # the poller idles at a rate of 0 until a MEAS:STREam subscriber asks for samples
+            channel = Channel(name, hm305.HM305(ser), args.poll_rate, args.log_capacity)
+            if args.shm:
+                shm_path = args.shm if len(ports) == 1 else f"{args.shm}.{name}"
+                channel.telemetry.listeners.append(ShmPublisher(shm_path).publish)
+            channel.start()
+            HM305pServer.channels[name] = channel
+            logging.info(f"channel {name}: {path}")
+        if args.metrics_port:
+            serve_metrics((args.addr, args.metrics_port), HM305pServer.channels)
+        if args.unix_socket:
+            local_server = LocalServer(args.unix_socket, HM305pServer)
+            local_server_thread = threading.Thread(target=local_server.serve_forever)
+            local_server_thread.daemon = True
+            local_server_thread.start()
         while True:
             try:
                 server = ReusableServer((args.addr, args.port), HM305pServer)
@@ -1,51 +1,164 @@
 import binascii
 import logging
 import struct
-from typing import Optional
+import time
+from typing import Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 
+def _make_crc_table() -> tuple:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 1:
+                crc >>= 1
+                crc ^= 0xa001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC_TABLE = _make_crc_table()
+
+
+class CRC16:
+    """
+    Incremental CRC-16/Modbus using a precomputed 256-entry table.
+    Feed it bytes as they arrive with update(), read the running CRC from value.
+    """
+
+    def __init__(self, data: bytes = b''):
+        self.value = 0xFFFF
+        self.update(data)
+
+    def update(self, data: bytes) -> 'CRC16':
+        crc = self.value
+        table = _CRC_TABLE
+        for i in data:
+            crc = (crc >> 8) ^ table[(crc ^ i) & 0xFF]
+        self.value = crc
+        return self
+
+
 class Modbus:
     WriteSingleRegister = 0x06
     ReadMultichannelRegisterInput = 0x03
+    WriteMultipleRegisters = 0x10
 
-    def __init__(self, fd):
+    def __init__(self, fd, metrics=None):
         """
         :param fd: the file descriptor with read/write methods to use
+        :param metrics: a modbus.metrics.ModbusMetrics to record each transaction in
         """
         self.s = fd
+        self.metrics = metrics
+        self._in_flight = None  # (function code, register, start time) while metrics are on
 
     def _send(self, data) -> int:
         d = data + struct.pack('<H', self.calculate_crc(data))
         logger.debug(f"TX[{len(binascii.hexlify(d)) / 2:02.0f}]: {binascii.hexlify(d)}")
+        if hasattr(self.s, 'reset_input_buffer'):
+            # drop any late bytes from a previous transaction, we read exact frame lengths now
+            self.s.reset_input_buffer()
+        if self.metrics is not None:
+            self._in_flight = (data[1], (data[2] << 8) | data[3], time.perf_counter())
         ret = self.s.write(d)
         # logging.debug(f"TX: done")
         # self.s.flush() doesn't seem to help
         return ret
 
-    def _recv(self, length=1) -> Optional[bytes]:
+    @staticmethod
+    def expected_length(header: bytes) -> Optional[int]:
+        """
+        Total length of a response frame (including CRC) from its first 3 bytes,
+        or None if the function code is unknown
+        """
+        function_code = header[1]
+        if function_code & 0x80:  # exception: addr, fn, code, crc
+            return 5
+        if function_code == Modbus.ReadMultichannelRegisterInput:  # addr, fn, count, data, crc
+            return 3 + header[2] + 2
+        if function_code == Modbus.WriteSingleRegister:  # addr, fn, reg, value, crc
+            return 8
+        if function_code == Modbus.WriteMultipleRegisters:  # addr, fn, reg, count, crc
+            return 8
+        return None
+
+    def _read_exactly(self, length: int, crc: CRC16) -> bytes:
+        """Read until length bytes are in, or the port times out, feeding each chunk to crc"""
+        data = b''
+        while len(data) < length:
+            b = self.s.read(length - len(data))
+            if len(b) == 0:
+                break
+            crc.update(b)
+            data += b
+        return data
+
+    def _read_until_idle(self, crc: CRC16) -> bytes:
         data = b''
         while True:
-            b = self.s.read(length)
+            b = self.s.read(1)
             if len(b) == 0:
                 break
+            crc.update(b)
             data += b
+        return data
+
+    def _recv(self) -> Optional[bytes]:
+        # the CRC runs over the frame as it arrives; over a whole frame, its own CRC included, it comes out 0
+        crc = CRC16()
+        data = self._read_exactly(3, crc)
+        if len(data) < 3:
+            if data:
+                logger.error(f"RX short header: {binascii.hexlify(data)}")
+            return None
+        length = self.expected_length(data)
+        if length is None:
+            # don't know how long this is, fall back to waiting for the line to go quiet
+            data += self._read_until_idle(crc)
+        else:
+            data += self._read_exactly(length - 3, crc)
+            if len(data) < length:
+                logger.error(f"RX short frame [{len(data)}/{length}]: {binascii.hexlify(data)}")
+                return None
         if len(data) > 2:
-            pkt_without_crc = self._proc_pkt_crc(data)
-            return pkt_without_crc
+            if crc.value != 0:
+                raise CRCError("RX")
+            logger.debug(f"RX[{len(binascii.hexlify(data)) / 2:02.0f}]: {binascii.hexlify(data)}")
+            return data[:-2]
         return None
 
-    def send_packet(self, device_address=1, address=5, value=None):
+    def send_packet(self, device_address=1, address=5, value=None, count=1):
+        """
+        Write value to a single register, or if value is None
+        read count consecutive registers starting at address
+        """
         if value is None:
-            value = 1  # todo this can be used to increase the length of a read!
-            # set value to "2" to read 2 consecutive registers!
+            value = count
             function_code = Modbus.ReadMultichannelRegisterInput
         else:
             function_code = Modbus.WriteSingleRegister
         pack = struct.pack('>BBHH', device_address, function_code, address, value)
         self._send(pack)
 
+    def send_multiple(self, device_address=1, address=5, values=()):
+        """Write consecutive registers starting at address in one frame"""
+        count = len(values)
+        pack = struct.pack(
+            f'>BBHHB{count}H',
+            device_address,
+            Modbus.WriteMultipleRegisters,
+            address,
+            count,
+            count * 2,
+            *values,
+        )
+        self._send(pack)
+
     class RxPacket:
         def __init__(self, pkt):
             self.sof = pkt[0]
@@ -56,62 +169,84 @@ class Modbus:
                 if length == 2:
                     self.data, = struct.unpack('>H', pkt[3:])
                 else:
-                    self.data = pkt  # todo why
+                    self.data = struct.unpack(f'>{length // 2}H', pkt[3:])
             elif self.address == 0x6:
                 assert len(pkt[2:]) == 4
                 addr, val = struct.unpack('>HH', pkt[2:])
                 self.data = (addr, val)
-            elif self.address == 0x83:
+            elif self.address == 0x10:
+                assert len(pkt[2:]) == 4
+                addr, count = struct.unpack('>HH', pkt[2:])
+                self.data = (addr, count)
+            elif self.address & 0x80:
                 if pkt[2] == 0x08:
                     logger.error(f"CRC TX Error {pkt}")
-                    self.data = (0, 0)
                 else:
                     logger.error(f"RX fail! {pkt}")
-                    self.data = 0
+                self.data = None
             else:
                 logger.error(f"RxPacket couldn't handle {self.address: x}")
-                self.data = 0
+                self.data = None
 
     def receive_packet(self):
-        p = self._recv()
+        """The response's data, or None for a timeout or an exception frame"""
+        try:
+            p = self._recv()
+        except CRCError:
+            self._record("crc")
+            raise
         if p:
             pkt = Modbus.RxPacket(p)
+            self._record("exception" if p[1] & 0x80 else None)
             return pkt.data
         else:
             logger.error(f"read timed out!")
-            return 0
+            self._record("timeout")
+            return None
 
-    def _proc_pkt_crc(self, data: bytes) -> bytes:
-        crc = self.calculate_crc(data[:-2])
-        packet_crc, = struct.unpack('<H', data[-2:])
-        if crc != packet_crc:
-            raise CRCError("RX")
-        logger.debug(f"RX[{len(binascii.hexlify(data)) / 2:02.0f}]: {binascii.hexlify(data)}")
-        return data[:-2]
+    def _record(self, outcome):
+        if self._in_flight is None:
+            return
+        function_code, register, started = self._in_flight
+        self._in_flight = None
+        self.metrics.record(function_code, register, time.perf_counter() - started, outcome)
 
     def set_by_addr(self, address: int, value) -> bool:
         self.send_packet(address=address, value=value)
         ret = self.receive_packet()
         return (address, value) == ret
 
-    def get_by_addr(self, address: int) -> int:
+    def write_registers(self, address: int, values) -> bool:
+        """
+        Write consecutive registers in one transaction (function 0x10).
+        The device applies all of them or none, so multi-word values stay consistent.
+        """
+        values = tuple(values)
+        self.send_multiple(address=address, values=values)
+        ret = self.receive_packet()
+        return (address, len(values)) == ret
+
+    def get_by_addr(self, address: int) -> Optional[int]:
+        """The register's value, None if the read failed"""
         self.send_packet(address=address, value=None)
         ret = self.receive_packet()
         return ret
 
+    def read_registers(self, address: int, count: int) -> Optional[Tuple[int, ...]]:
+        """Read count consecutive registers in one transaction, None if the read failed"""
+        self.send_packet(address=address, count=count)
+        ret = self.receive_packet()
+        if count == 1 and isinstance(ret, int):
+            ret = (ret,)
+        if not isinstance(ret, tuple) or len(ret) != count:
+            logger.error(f"block read of {count} @ {address:#06x} failed: {ret}")
+            return None
+        return ret
+
     @staticmethod
     def calculate_crc(data: bytes) -> int:
         """Calculate the CRC16 of a datagram"""
-        crc = 0xFFFF
-        for i in data:
-            crc ^= i
-            for _ in range(8):
-                if crc & 1:
-                    crc >>= 1
-                    crc ^= 0xa001
-                else:
-                    crc >>= 1
-        return crc
+        return CRC16(data).value
 
 
 class CRCError(Exception):
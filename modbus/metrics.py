@@ -0,0 +1,90 @@
+from bisect import bisect_left
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram: counts[i] holds the observations <= bounds[i] (and above
+    bounds[i - 1]), the last count everything above the last bound.
+    Recording is a bisect and a few additions, cheap enough to leave on.
+    """
+
+    LATENCY_BOUNDS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q quantile (the max, past the last bound)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class ModbusMetrics:
+    """
+    Transaction latency per function code and per register, plus error counters.
+    One of these belongs to one Modbus instance and is only written from the thread
+    driving that port, so recording takes no lock.
+    """
+
+    def __init__(self, bounds=Histogram.LATENCY_BOUNDS):
+        self._bounds = bounds
+        self.by_function = {}  # function code -> Histogram
+        self.by_register = {}  # first register of the transaction -> Histogram
+        self.crc_errors = 0
+        self.timeouts = 0
+        self.exceptions = 0  # exception frames from the device
+
+    def record(self, function_code: int, register: int, seconds: float, outcome: str = None):
+        """
+        :param outcome: None for a good response, else "crc", "timeout" or "exception"
+        """
+        histogram = self.by_function.get(function_code)
+        if histogram is None:
+            histogram = self.by_function[function_code] = Histogram(self._bounds)
+        histogram.observe(seconds)
+        histogram = self.by_register.get(register)
+        if histogram is None:
+            histogram = self.by_register[register] = Histogram(self._bounds)
+        histogram.observe(seconds)
+        if outcome == "crc":
+            self.crc_errors += 1
+        elif outcome == "timeout":
+            self.timeouts += 1
+        elif outcome == "exception":
+            self.exceptions += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "crc_errors": self.crc_errors,
+            "timeouts": self.timeouts,
+            "exceptions": self.exceptions,
+            "by_function": {f"{fn:#04x}": h.as_dict() for fn, h in list(self.by_function.items())},
+            "by_register": {f"{reg:#06x}": h.as_dict() for reg, h in list(self.by_register.items())},
+        }
@@ -4,5 +4,7 @@ PORT=${1}
 shift 1
 HOST="10.2.0.9"
 #echo "$@"
-X=$(echo "$@" | nc "$HOST" "$PORT")
+exec 3<>"/dev/tcp/$HOST/$PORT"
+echo "$@" >&3
+read -r X <&3
 echo "$X "
@@ -6,13 +6,12 @@ Author: Jose Tiago Macara Coutinho
 
 import re
 import inspect
+import threading
 from functools import partial
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from re import Pattern
 from typing import AnyStr
 
-import numpy
-
 __version__ = '0.2.0'
 
 
@@ -56,8 +55,12 @@ def encode_on_off(s) -> str:
         raise ValueError("Cannot encode OnOff value {0}".format(s))
 
 
-__decode_IntArray = partial(numpy.fromstring, dtype=int, sep=",")
-__decode_FloatArray = partial(numpy.fromstring, dtype=float, sep=",")
+def __decode_Array(s, dtype):
+    return [dtype(x) for x in s.split(",") if x.strip()]
+
+
+__decode_IntArray = partial(__decode_Array, dtype=int)
+__decode_FloatArray = partial(__decode_Array, dtype=float)
 
 #: SCPI command
 #: accepts the following keys:
@@ -173,6 +176,78 @@ def cmd_expr_to_reg_expr(cmd_expr: str) -> Pattern[AnyStr]:
     return re.compile(cmd_expr_to_reg_expr_str(cmd_expr), re.IGNORECASE)
 
 
+def expand_optional(cmd_expr: str) -> list:
+    """
+    All the variants of a SCPI command expression with each [optional] part
+    either present or absent
+
+    Example::
+
+    >>> expand_optional('SYSTem:ERRor[:NEXT]')
+    ['SYSTem:ERRor:NEXT', 'SYSTem:ERRor']
+    """
+    start = cmd_expr.find("[")
+    if start < 0:
+        return [cmd_expr]
+    depth = 0
+    for end in range(start, len(cmd_expr)):
+        if cmd_expr[end] == "[":
+            depth += 1
+        elif cmd_expr[end] == "]":
+            depth -= 1
+            if depth == 0:
+                break
+    head, inner, tail = cmd_expr[:start], cmd_expr[start + 1:end], cmd_expr[end + 1:]
+    variants = []
+    for rest in expand_optional(tail):
+        for middle in expand_optional(inner):
+            variants.append(head + middle + rest)
+        variants.append(head + rest)
+    return variants
+
+
+class _TrieNode(object):
+    __slots__ = ("children", "cmd_expr")
+
+    def __init__(self):
+        self.children = {}
+        self.cmd_expr = None
+
+
+class CommandTrie(object):
+    """
+    Resolves a command header to its SCPI command expression one mnemonic at a
+    time, each mnemonic being accepted in its short or long form.
+    Lookups cost a dict access per ':'-separated part of the header.
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+
+    def insert(self, cmd_expr: str):
+        for variant in expand_optional(cmd_expr):
+            node = self._root
+            for mnemonic in variant.lstrip(":").split(":"):
+                short = "".join(c for c in mnemonic if not c.islower())
+                child = node.children.get(short) or node.children.get(mnemonic.upper()) or _TrieNode()
+                node.children.setdefault(short, child)
+                node.children.setdefault(mnemonic.upper(), child)
+                node = child
+            if node.cmd_expr is None:  # first registered expression wins, like the regex scan did
+                node.cmd_expr = cmd_expr
+
+    def find(self, cmd_name: str):
+        """The command expression cmd_name resolves to, or None"""
+        if cmd_name.startswith(":"):
+            cmd_name = cmd_name[1:]
+        node = self._root
+        for mnemonic in cmd_name.upper().split(":"):
+            node = node.children.get(mnemonic)
+            if node is None:
+                return None
+        return node.cmd_expr
+
+
 class Commands(object):
     """
     A dict like container for SCPI commands. Construct a Commands object like a
@@ -216,9 +291,14 @@ class Commands(object):
         True
     """
 
+    #: maximum number of resolved command names remembered
+    cache_size = 256
+
     def __init__(self, *args, **kwargs):
         self.command_expressions = {}
-        self._command_cache = {}
+        self._trie = CommandTrie()
+        self._command_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
         for arg in args:
             self.update(arg)
         self.update(kwargs)
@@ -231,21 +311,17 @@ class Commands(object):
             min_command=min_cmd,
             max_command=max_cmd,
         )
+        if cmd_expr not in self.command_expressions:
+            self._trie.insert(cmd_expr)
         self.command_expressions[cmd_expr] = cmd_info
-        # update cache with short and long version
-        self.get_command_expression(min_cmd)
-        self.get_command_expression(max_cmd)
         return cmd_info
 
     def __getitem__(self, cmd_name):
         return self.get_command(cmd_name)['value']
 
     def __delitem__(self, cmd_expr):
-        reg_expr = self.command_expressions.pop(cmd_expr)['re']
-        del_cache = {k for k, v in self._command_cache.items()
-                     if reg_expr.match(k)}
-        for k in del_cache:
-            del self._command_cache[k]
+        del self.command_expressions[cmd_expr]
+        self._rebuild()
 
     def __contains__(self, cmd_name):
         return self.get(cmd_name) is not None
@@ -255,7 +331,14 @@ class Commands(object):
 
     def clear(self):
         self.command_expressions.clear()
-        self._command_cache.clear()
+        self._rebuild()
+
+    def _rebuild(self):
+        self._trie = CommandTrie()
+        for cmd_expr in self.command_expressions:
+            self._trie.insert(cmd_expr)
+        with self._cache_lock:
+            self._command_cache.clear()
 
     def keys(self):
         return self.command_expressions.keys()
@@ -269,15 +352,19 @@ class Commands(object):
 
     def get_command_expression(self, cmd_name):
         cmd_name_u = cmd_name.upper()
-        try:
-            return self._command_cache[cmd_name_u]
-        except KeyError:
-            for cmd_expr, cmd_info in self.command_expressions.items():
-                reg_expr = cmd_info["re"]
-                if reg_expr.match(cmd_name):
-                    self._command_cache[cmd_name.upper()] = cmd_expr
-                    return cmd_expr
-        raise KeyError(cmd_name)
+        with self._cache_lock:
+            cmd_expr = self._command_cache.get(cmd_name_u)
+            if cmd_expr is not None:
+                self._command_cache.move_to_end(cmd_name_u)
+                return cmd_expr
+        cmd_expr = self._trie.find(cmd_name_u)
+        if cmd_expr is None:
+            raise KeyError(cmd_name)  # misses aren't cached, they're cheap and unbounded
+        with self._cache_lock:
+            self._command_cache[cmd_name_u] = cmd_expr
+            if len(self._command_cache) > self.cache_size:
+                self._command_cache.popitem(last=False)
+        return cmd_expr
 
     def get(self, cmd_name, default=None):
         try:
@@ -288,7 +375,7 @@ class Commands(object):
     def update(self, commands):
         if isinstance(commands, Commands):
             self.command_expressions.update(commands.command_expressions)
-            self._command_cache.update(commands._command_cache)
+            self._rebuild()
         elif isinstance(commands, dict):
             for cmd_expr, cmd in commands.items():
                 self[cmd_expr] = cmd
@@ -1,17 +1,24 @@
 #!/bin/bash
 
+# one connection for the whole ramp, the server answers each line with one line
+exec 3<>"/dev/tcp/127.0.0.1/$1"
 
-echo "INIT 0" | nc 127.0.0.1 $1
+SEND() {
+  echo "$@" >&3
+  read -r REPLY <&3
+  echo "$REPLY"
+}
 
-#for i in {0..300}; do
-#  v=$(bc <<< "scale=1; $i/10")
-#  echo "VOLT:UP $v"
-#  echo "VOLT:UP $v" | nc 127.0.0.1 $1
-#done
+SEND "INIT 0"
 
+# +30 V from the current setpoint at ${2:-10} V/s, stepped by the server
+TARGET="$(bc <<< "scale=2; 30+$(SEND 'VOLT:SETP?')")"
+echo VOLT:RAMP $TARGET,${2:-10}
+SEND "VOLT:RAMP $TARGET,${2:-10}"
 
-for i in {0..300}; do
-  V="$(bc <<< "scale=2; 0.1+$(echo 'VOLT:SETP? ' | nc 127.0.0.1 $1)")"
-  echo VOLT $V
-  echo VOLT $V | nc 127.0.0.1 $1
-done
\ No newline at end of file
+while :; do
+  STATUS="$(SEND 'VOLT:RAMP?')"  # state,setpoint,target,progress,steps,seconds
+  echo "$STATUS"
+  [[ $STATUS == RUNNING* ]] || break
+  sleep 0.5
+done